@@ -183,10 +183,12 @@ def infer_answer(chat_history: ChatHistory, next_question: Question) -> Union[st
 
 
 def get_summary(conversation_history: List[Dict[str, Any]]) -> str:
-    summary_prompt = prompts["get_summary"]
+    # Summarize everything at once: an empty running summary and all answers as new.
+    summary_prompt = prompts["update_summary"]
     system_message = summary_prompt["system"]
     user_message = summary_prompt["user"].format(
-        conversation_history="\n".join([f"{entry['question_text']}: {entry['user_answer']}" for entry in conversation_history])
+        summary="(nothing yet)",
+        new_answers="\n".join([f"{entry['question_text']}: {entry['user_answer']}" for entry in conversation_history])
     )
     try:
         response = openai.chat.completions.create(
@@ -210,11 +212,11 @@ def process_valinta_answer(question: Question, user_answer: str) -> Tuple[str, L
 
     map_prompt = prompts["map_answer"]
     system_message = map_prompt["system"]
-    user_message = map_prompt["user"].format(
+    context_message = map_prompt["context"].format(
         question_text=question.questionText["FI"],
-        user_answer=user_answer,
         options=options_str
     )
+    user_message = map_prompt["user"].format(user_answer=user_answer)
     response_schema = map_prompt["response_schema"]
 
     try:
@@ -222,6 +224,7 @@ def process_valinta_answer(question: Question, user_answer: str) -> Tuple[str, L
             model="gpt-4.1-2025-04-14",
             messages=[
                 {"role": "system", "content": system_message},
+                {"role": "user", "content": context_message},
                 {"role": "user", "content": user_message}
             ],
             response_format={
@@ -270,11 +273,11 @@ def process_ligert_answer(question: Question, user_answer: str) -> Tuple[str, Li
 
     map_prompt = prompts["map_answer"]
     system_message = map_prompt["system"]
-    user_message = map_prompt["user"].format(
+    context_message = map_prompt["context"].format(
         question_text=question.questionText["FI"],
-        user_answer=user_answer,
         options=options_str
     )
+    user_message = map_prompt["user"].format(user_answer=user_answer)
     response_schema = map_prompt["response_schema"]
 
     try:
@@ -282,6 +285,7 @@ def process_ligert_answer(question: Question, user_answer: str) -> Tuple[str, Li
             model="gpt-4.1-2025-04-14",
             messages=[
                 {"role": "system", "content": system_message},
+                {"role": "user", "content": context_message},
                 {"role": "user", "content": user_message}
             ],
             response_format={
@@ -2,41 +2,103 @@ import os
 import json
 import uuid
 import time
-from typing import List, Dict, Any, Union, Tuple, Optional
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Union, Tuple, Optional, AsyncIterator
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from pydantic import BaseModel
-import openai
 from pathlib import Path
 from dotenv import load_dotenv
 import logging
 
+from utils import llm, answer_matcher
+from utils.llm_cache import LLMCache
+from utils.session_store import create_session_store
+from utils.session_lock import SessionLocks
+from utils.tree_registry import QuestionTree, TreeRegistry
+from utils.question_nodes import QuestionNode, build_node_table
+from utils.tree_binary import MappedQuestions, open_compiled_tree
+from utils import conversation_context, metrics, tracing
+from utils.tree_selector import TreeSelector, load_keyword_groups
+from utils.prompt_plans import LIGERT_SCALE, PromptPlan, build_prompt_plan
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    reload_task = None
+    if TREE_RELOAD_INTERVAL > 0:
+        reload_task = asyncio.create_task(tree_registry.watch(TREE_RELOAD_INTERVAL, TREE_VERSION_IDLE_TTL))
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop(LOOP_PROBE_INTERVAL, LOOP_STALL_THRESHOLD))
+    yield
+    if reload_task:
+        reload_task.cancel()
+    loop_monitor.cancel()
+    await llm.close_client()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001"],
     allow_credentials=True,
     allow_methods=["GET", "POST"],
-    allow_headers=["Content-Type"],
+    allow_headers=["Content-Type", "Idempotency-Key"],
+    expose_headers=["X-ARS-Trace-Id"],
 )
 
 load_dotenv()
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-if not openai.api_key:
+if not os.environ.get("OPENAI_API_KEY"):
     raise ValueError("OPENAI_API_KEY environment variable must be set")
 
+DATA_DIR = "./data"
 CHAT_HISTORY_DIR = "./data/chatHistory"
 JSON_TREES_DIR = "../excel/json"
+COMPILED_TREES_DIR = "../excel/compiled"
+TREE_KEYWORDS_FILE = "../excel/trees.py"
+DEFAULT_TREE = "VATSAOIREET"
+TREE_ARCHIVE_DIR = "./data/treeVersions"
+TREE_RELOAD_INTERVAL = float(os.environ.get("ARS_TREE_RELOAD_INTERVAL", "30"))  # 0 disables hot reload
+TREE_VERSION_IDLE_TTL = float(os.environ.get("ARS_TREE_VERSION_IDLE_TTL", str(6 * 3600)))
+LLM_CACHE_PATH = os.environ.get("ARS_LLM_CACHE_PATH", "./data/llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.environ.get("ARS_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("ARS_LLM_CACHE_MAX_ENTRIES", "200000"))
+SESSION_STORE = os.environ.get("ARS_SESSION_STORE", "journal")  # "journal", "file" or "sqlite"
+SESSION_CACHE_SIZE = int(os.environ.get("ARS_SESSION_CACHE_SIZE", "1024"))
+SESSION_LOCK_DIR = "./data/locks"
+SESSION_LOCK_TIMEOUT = float(os.environ.get("ARS_SESSION_LOCK_TIMEOUT", "120"))
+ACTIVITY_PATH = "./data/activity.sqlite"
+ACTIVE_SESSION_WINDOW = float(os.environ.get("ARS_ACTIVE_SESSION_WINDOW", "900"))
+LOOP_PROBE_INTERVAL = 0.1
+LOOP_STALL_THRESHOLD = 0.005
+TRACE_DIR = "./data/traces"
+PROFILE_DIR = "./data/profiles"
+TRACE_SAMPLE_RATE = float(os.environ.get("ARS_TRACE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("ARS_PROFILE_SAMPLE_RATE", "0"))
+# X-ARS-Trace / X-ARS-Profile with this value force tracing / profiling; unset, the headers are ignored
+DEBUG_TOKEN = os.environ.get("ARS_DEBUG_TOKEN") or None
+DEBUG_DIR_MAX_MB = int(os.environ.get("ARS_DEBUG_DIR_MAX_MB", "256"))  # per directory, oldest files pruned first
+TREE_SELECT_MIN_SCORE = float(os.environ.get("ARS_TREE_SELECT_MIN_SCORE", "0.08"))
+TREE_SELECT_MARGIN = float(os.environ.get("ARS_TREE_SELECT_MARGIN", "1.3"))  # best must beat the runner-up by this factor
+SPECULATIVE_INFERENCE = os.environ.get("ARS_SPECULATIVE_INFERENCE", "1") == "1"
+LOOKAHEAD_DEPTH = int(os.environ.get("ARS_LOOKAHEAD_DEPTH", "6"))  # 0 disables batched lookahead
+LOOKAHEAD_MIN_CONFIDENCE = float(os.environ.get("ARS_LOOKAHEAD_MIN_CONFIDENCE", "0.8"))
+LOOKAHEAD_MIN_WORDS = int(os.environ.get("ARS_LOOKAHEAD_MIN_WORDS", "6"))  # answers this long may cover later questions
+CONTEXT_RECENT_TURNS = int(os.environ.get("ARS_CONTEXT_RECENT_TURNS", "6"))  # history entries replayed verbatim
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("ARS_CONTEXT_TOKEN_BUDGET", "1500"))
+SUMMARY_DRAFTS = os.environ.get("ARS_SUMMARY_DRAFTS", "1") == "1"  # keep a running summary between turns
 
 try:
-    with open("./prompts.json", "r", encoding="utf-8") as f:
-        prompts = json.load(f)
+    with open("./prompts.json", "rb") as f:
+        prompts_raw = f.read()
+    prompts = json.loads(prompts_raw.decode("utf-8"))
+    prompts_version = hashlib.sha256(prompts_raw).hexdigest()[:16]
 except FileNotFoundError:
     logger.error("prompts.json file not found")
     raise
@@ -44,6 +106,24 @@ except json.JSONDecodeError as e:
     logger.error(f"Invalid JSON in prompts.json: {e}")
     raise
 
+# map_answer / select_tree run at temperature 0, so their results are cached across workers
+llm_cache = LLMCache(LLM_CACHE_PATH, f"{prompts_version}:{llm.MODEL}", LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
+
+app.add_middleware(
+    tracing.TracingMiddleware,
+    trace_dir=TRACE_DIR,
+    profile_dir=PROFILE_DIR,
+    trace_rate=TRACE_SAMPLE_RATE,
+    profile_rate=PROFILE_SAMPLE_RATE,
+    debug_token=DEBUG_TOKEN,
+    max_dir_bytes=DEBUG_DIR_MAX_MB * 1024 * 1024,
+)
+
+session_store = create_session_store(SESSION_STORE, DATA_DIR, CHAT_HISTORY_DIR, SESSION_CACHE_SIZE)
+# 同一会话的请求在所有 worker 之间串行处理
+session_locks = SessionLocks(SESSION_LOCK_DIR)
+activity = metrics.ActivityTracker(ACTIVITY_PATH, ACTIVE_SESSION_WINDOW)
+
 # 定义初始问题
 INITIAL_QUESTION = {
     "questionId": "initial_question",
@@ -58,299 +138,522 @@ class ChatHistory(BaseModel):
     chatHistory: List[Dict[str, Any]] = []
     current_question_id: Optional[str] = None
     selected_tree: Optional[str] = None  # 记录选择的问题树文件名
-    temp_next_q_id: Optional[str] = None
+    tree_version: Optional[str] = None  # 会话固定使用的问题树版本
+    temp_next_q_id: Optional[str] = None  # 后台预判的下一个问题
     temp_inferred_answer: Optional[str] = None
+    temp_inferred_answer_id: Optional[str] = None
+    temp_stack_key: Optional[str] = None  # 预判时的栈指纹，栈变化则作废
     retry_counts: Dict[str, int] = {}
+    summary_parts: List[str] = []  # 后台逐步累积的总结草稿，每次更新追加一段（按日志只追加存储）
+    summary_parts_upto: int = 0  # 草稿已覆盖的 chatHistory 条数
+    last_request_id: Optional[str] = None  # 最近一次请求的幂等键
+    last_response: Optional[Dict[str, Any]] = None
+    choice_question_id: Optional[str] = None  # 以编号选项形式展示的问题
 
 class InstanceResponse(BaseModel):
     session_id: str
     question: str
     answer: str
     status: str
+    choices: Optional[List[Dict[str, str]]] = None  # numbered options, set while the LLM is unavailable
 
 class InstanceRequest(BaseModel):
     session_id: str
     user_answer: str
+    request_id: Optional[str] = None  # idempotency key; the Idempotency-Key header takes precedence
 
-class Question(BaseModel):
-    questionId: str
-    questionText: Dict[str, str]
-    category: Dict[str, Any]
-    type: str
-    answers: List
+def build_question_tree(name: str, file_contents: List[Dict[str, Any]]) -> QuestionTree:
+    root_ids, nodes = build_node_table(file_contents)
+    return QuestionTree(name, root_ids, nodes)
 
-Question.model_rebuild()
+def load_compiled_tree(name: str, source_sha256: bytes) -> Optional[QuestionTree]:
+    return open_compiled_tree(os.path.join(COMPILED_TREES_DIR, f"{name}.arsb"), name, source_sha256)
 
-# 全局问题映射，动态更新
-question_map = {}
+def tree_texts(tree: QuestionTree) -> List[str]:
+    """Question and answer texts of a tree; compiled trees are read from their records, so no node gets decoded."""
+    if isinstance(tree.questions, MappedQuestions):
+        return tree.questions.texts()
+    texts = []
+    for question in tree.questions.values():
+        texts.append(question.text)
+        texts.extend(answer.text for answer in question.answers)
+    return texts
 
-def load_question_tree(tree_filename: str) -> Dict[str, Question]:
-    file_path = os.path.join(JSON_TREES_DIR, tree_filename)
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            file_contents = json.load(f)
-            question_tree = {}
-            for q in file_contents:
-                question = Question(**q)
-                question_tree[question.questionId] = question
-            return question_tree
-    except FileNotFoundError:
-        logger.error(f"Question tree file not found at {file_path}")
-        raise
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in question tree file {file_path}: {e}")
-        raise
-
-def build_question_map(question_tree: Dict[str, Question]) -> Dict[str, Question]:
-    question_map = {}
-    def build_helper(question_id: str, question: Question) -> None:
-        if question_id not in question_map:
-            question_map[question_id] = question
-        for answer in question.answers or []:
-            for sub_question in answer.get("question", []):
-                sub_q_id = sub_question["questionId"]
-                if sub_q_id not in question_map:
-                    sub_q_obj = Question(**sub_question)
-                    question_map[sub_q_id] = sub_q_obj
-                build_helper(sub_q_id, sub_q_obj)
-    for q_id, q in question_tree.items():
-        build_helper(q_id, q)
-    return question_map
-
-question_map = build_question_map(load_question_tree("VATSAOIREET.json"))
-
-def load_chat_history(session_id: str) -> Optional[ChatHistory]:
-    filename = os.path.join(CHAT_HISTORY_DIR, f"{session_id}.json")
+tree_selector: Optional[TreeSelector] = None
+
+def rebuild_tree_selector() -> None:
+    """Rebuild the local tree selection index. Hot reload calls this from its refresh thread."""
+    global tree_selector
+    started = time.perf_counter()
+    keyword_groups = load_keyword_groups(TREE_KEYWORDS_FILE)
+    documents = {}
+    for name in tree_registry.names():
+        tree = tree_registry.tree(name)
+        documents[name] = (keyword_groups.get(name, []), tree_texts(tree))
+    # One assignment, so requests see either the old or the new index.
+    tree_selector = TreeSelector(documents)
+    logger.info(f"Tree selection index built over {len(documents)} trees in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+# 启动时加载全部问题树，请求路径上不再读取树文件
+tree_registry = TreeRegistry(
+    JSON_TREES_DIR, build_question_tree, archive_dir=TREE_ARCHIVE_DIR, load_compiled=load_compiled_tree,
+    on_reload=rebuild_tree_selector
+)
+tree_registry.load()
+rebuild_tree_selector()
+
+def get_tree_selector() -> TreeSelector:
+    return tree_selector
+
+def get_question(chat_history: ChatHistory, question_id: str) -> QuestionNode:
+    with metrics.phase("tree_lookup"):
+        return tree_registry.question(
+            chat_history.selected_tree or DEFAULT_TREE, question_id, chat_history.tree_version
+        )
+
+async def preload_pinned_tree(chat_history: ChatHistory) -> None:
+    """Read the session's tree version from the archive off the event loop if this worker does not have it."""
+    await tree_registry.preload(chat_history.selected_tree or DEFAULT_TREE, chat_history.tree_version)
+
+def get_prompt_plan(chat_history: ChatHistory, question_id: str) -> PromptPlan:
+    with metrics.phase("tree_lookup"):
+        tree = tree_registry.tree(chat_history.selected_tree or DEFAULT_TREE, chat_history.tree_version)
+        plan = tree.plans.get(question_id)
+        if plan is None:
+            # Built on first use: building them all at load would decode every node of a memory-mapped tree.
+            plan = tree.plans[question_id] = build_prompt_plan(tree.get(question_id), prompts["map_answer"])
+        return plan
+
+async def load_chat_history(session_id: str) -> Optional[ChatHistory]:
     try:
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                return ChatHistory(**data)
+        with metrics.phase("session_load"), tracing.span("load_chat_history"):
+            with tracing.span("session_store.load"):
+                # Journal reads and SQLite queries block; run them in a thread like saves.
+                data = await asyncio.to_thread(session_store.load, session_id)
+            if data is not None:
+                with tracing.span("ChatHistory.validate"):
+                    return ChatHistory(**data)
     except json.JSONDecodeError as e:
         logger.error(f"Failed to decode chat history for session {session_id}: {e}")
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Failed to load chat history for session {session_id}: {e}")
     return None
 
-def save_chat_history(chat_history: ChatHistory) -> None:
-    filename = os.path.join(CHAT_HISTORY_DIR, f"{chat_history.session_id}.json")
-    os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+async def save_chat_history(chat_history: ChatHistory) -> None:
     try:
-        with open(filename, "w", encoding="utf-8") as file:
-            json.dump(chat_history.model_dump(), file, indent=4)
-    except IOError as e:
+        with metrics.phase("save"), tracing.span("save_chat_history"):
+            with tracing.span("ChatHistory.dump"):
+                data = chat_history.model_dump()
+            with tracing.span("session_store.save"):
+                # The journal fsyncs every save; wait for that in a thread, not on the event loop.
+                await asyncio.to_thread(session_store.save, chat_history.session_id, data)
+    except (OSError, sqlite3.Error) as e:
         logger.error(f"Failed to save chat history for session {chat_history.session_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to save chat history")
 
-def select_question_tree(user_answer: str, available_trees: List[str]) -> Tuple[Optional[str], str]:
+@tracing.traced
+async def select_question_tree(user_answer: str, available_trees: List[str]) -> Tuple[Optional[str], str]:
+    selected_tree, ranking = get_tree_selector().select(user_answer, TREE_SELECT_MIN_SCORE, TREE_SELECT_MARGIN)
+    ranking = [(name, score) for name, score in ranking if name in available_trees]
+    if selected_tree in available_trees:
+        runner_up = f", next {ranking[1][0]} {ranking[1][1]:.3f}" if len(ranking) > 1 else ""
+        return selected_tree, f"Local index score {ranking[0][1]:.3f}{runner_up}"
+    if ranking and ranking[0][1] >= TREE_SELECT_MIN_SCORE:
+        # Too close to call: let the LLM decide between the close candidates only.
+        available_trees = [name for name, score in ranking if score * TREE_SELECT_MARGIN >= ranking[0][1]]
+    logger.info(f"Local tree index undecided for {user_answer!r}, asking LLM among {available_trees}")
+
     prompt = prompts["select_tree"]
     system_message = prompt["system"]
     user_message = prompt["user"].format(
         user_answer=user_answer,
         tree_names=", ".join(available_trees)
     )
+    cache_key = llm_cache.make_key(
+        "select_tree", ",".join(available_trees), answer_matcher.normalize_answer(user_answer)
+    )
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",  # 使用实际可用模型
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "select_tree_response",
-                    "schema": prompt["response_schema"],
-                    "strict": True
-                }
-            },
-            temperature=0.0,
-            max_tokens=200
-        )
-        result = json.loads(response.choices[0].message.content)
+        hit, result = await asyncio.to_thread(llm_cache.get, cache_key)
+        metrics.LLM_CACHE.labels("select_tree", "hit" if hit else "miss").inc()
+        if not hit:
+            result = await llm.complete_json(
+                "select_tree",
+                [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": user_message}
+                ],
+                prompt["response_schema"],
+                max_tokens=200
+            )
+            await asyncio.to_thread(llm_cache.set, cache_key, result)
         logger.info(f"Selected tree: {result['selected_tree']}, Explanation: {result['explanation']}")
+        if result["selected_tree"] not in available_trees:
+            raise ValueError(f"LLM chose unknown tree {result['selected_tree']!r}")
         return result["selected_tree"], result["explanation"]
+    except llm.LLMUnavailable as e:
+        logger.warning(f"LLM unavailable for tree selection, using local ranking: {e}")
+        if ranking:
+            return ranking[0][0], f"Local index score {ranking[0][1]:.3f} (LLM unavailable)"
+        return DEFAULT_TREE, "Default tree (LLM unavailable)"
     except Exception as e:
         logger.error(f"Error selecting question tree: {e}")
-        return None, f"Error selecting tree: {e}"
+        if ranking:
+            return ranking[0][0], f"Local index score {ranking[0][1]:.3f} (error selecting tree: {e})"
+        return DEFAULT_TREE, f"Default tree (error selecting tree: {e})"
+
+def conversation_messages(chat_history: ChatHistory) -> List[Dict[str, str]]:
+    """History for the inference prompts: older entries as facts plus the last CONTEXT_RECENT_TURNS entries verbatim."""
+    return conversation_context.build_context(
+        chat_history.chatHistory,
+        CONTEXT_RECENT_TURNS,
+        prompts["conversation_facts"]["system"],
+        CONTEXT_TOKEN_BUDGET,
+    )
+
+def record_inferred_answer(chat_history: ChatHistory, question_id: str, inferred_text: Optional[str], answer_id: str,
+                           source: str) -> None:
+    """Answer ``question_id`` from earlier statements and push the follow-up questions it opens."""
+    metrics.INFERRED.labels(chat_history.selected_tree or DEFAULT_TREE, source).inc()
+    plan = get_prompt_plan(chat_history, question_id)
+    chat_history.chatHistory.append({
+        "question_id": question_id,
+        "question_text": get_question(chat_history, question_id).text,
+        "user_answer": inferred_text,
+        "chosen_answer": plan.answer_texts[answer_id].replace("__", inferred_text or ""),
+        "answer_id": answer_id,
+        "timestamp": str(time.time()),
+        "inferred": True,
+        "re_ask": False,
+        "skipped": False
+    })
+    chat_history.stack.extend(plan.answer_children[answer_id][::-1])
 
-def infer_answer(chat_history: ChatHistory, next_question: Question) -> Tuple[Optional[str], Optional[str]]:
-    options = [answer["answerText"] for answer in next_question.answers]
-    options_str = "\n".join([f"- {answer['answerId']}: {text}" for text, answer in zip(options, next_question.answers)])
+@tracing.traced
+async def infer_answer(chat_history: ChatHistory, next_question: QuestionNode) -> Tuple[Optional[str], Optional[str]]:
+    options_str = "\n".join([f"- {answer.answer_id}: {answer.text}" for answer in next_question.answers])
 
     infer_prompt = prompts["infer_answer"]
     system_message = infer_prompt["system"]
     user_message = infer_prompt["user"].format(
-        next_question_text=next_question.questionText["FI"],
+        next_question_text=next_question.text,
         options=options_str
     )
     response_schema = infer_prompt["response_schema"]
-    history = chat_history.chatHistory
-    message_history = []
-    for entry in history:
-        message_history.append({
-            "role": "assistant",
-            "content": f"{entry['question_text']}"
-        })
-        message_history.append({
-            "role": "user",
-            "content": f"{entry['user_answer']}"
-        })
+    message_history = conversation_messages(chat_history)
         
     logger.info(f"Message history for session {chat_history.session_id}: {message_history}")
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
+        result = await llm.complete_json(
+            "infer_answer",
+            [
                 {"role": "system", "content": system_message},
                 *message_history,
                 {"role": "user", "content": user_message},
             ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "infer_answer_response",
-                    "schema": response_schema,
-                    "strict": True
-                }
-            },
-            temperature=0.0,
+            response_schema,
             max_tokens=500
         )
-        result = json.loads(response.choices[0].message.content)
         logger.info(f"Inferred answer: {result}")
         return (result["inferred_answer_text"], result["inferred_answer_id"]) if result["answer_found"] else (None, None)
     except Exception as e:
         logger.error(f"Error in infer_answer for session {chat_history.session_id}: {e}")
         return None, None
 
-def get_summary(conversation_history: List[Dict[str, Any]]) -> str:
-    summary_prompt = prompts["get_summary"]
-    system_message = summary_prompt["system"]
-    user_message = summary_prompt["user"].format(
-        conversation_history="\n".join([f"{entry['question_text']}: {entry['user_answer']}" for entry in conversation_history])
+def speculation_key(chat_history: ChatHistory) -> str:
+    """Fingerprint of the position a speculative inference was made for."""
+    state = [chat_history.tree_version or "", chat_history.current_question_id or "", *chat_history.stack]
+    return hashlib.sha1("\x1f".join(state).encode("utf-8")).hexdigest()
+
+@tracing.traced
+async def speculate_next_answer(session_id: str) -> None:
+    """Run infer_answer for the question after the current one while the patient is typing.
+
+    Runs as a background task after the response has been sent. The result is
+    stored on the session together with the stack fingerprint it was made for;
+    the next turn only uses it if the stack is still exactly the same.
+    """
+    chat_history = await load_chat_history(session_id)
+    if not chat_history or not chat_history.current_question_id or not chat_history.stack:
+        return
+    await preload_pinned_tree(chat_history)
+    key = speculation_key(chat_history)
+    if chat_history.temp_stack_key == key:
+        return  # already speculated for this position (e.g. the current question was re-asked)
+    next_qid = chat_history.stack[-1]
+    next_question = get_question(chat_history, next_qid)
+    if next_question.type != "valinta" or not next_question.answers:
+        return
+    inferred_text, inferred_id = await infer_answer(chat_history, next_question)
+    if inferred_id not in get_prompt_plan(chat_history, next_qid).answer_texts:
+        inferred_text, inferred_id = None, None
+
+    # Re-read: the session may have moved on while the LLM call was running.
+    try:
+        async with session_locks.hold(session_id, SESSION_LOCK_TIMEOUT):
+            chat_history = await load_chat_history(session_id)
+            if not chat_history or speculation_key(chat_history) != key:
+                logger.info(f"Discarding speculative inference for {next_qid} in session {session_id}: stack changed")
+                return
+            chat_history.temp_next_q_id = next_qid
+            chat_history.temp_inferred_answer = inferred_text
+            chat_history.temp_inferred_answer_id = inferred_id
+            chat_history.temp_stack_key = key
+            await save_chat_history(chat_history)
+    except TimeoutError as e:
+        logger.warning(f"Dropping speculative inference: {e}")
+
+def apply_speculation(chat_history: ChatHistory) -> None:
+    """Answer the next stacked question from a stored speculative inference, if it is still valid.
+
+    Called after the current answer has been applied but before the next
+    question is popped, i.e. with the same current_question_id the
+    speculation was made under. Any children the current answer pushed change
+    the fingerprint and the speculation is dropped.
+    """
+    next_qid = chat_history.temp_next_q_id
+    inferred_text = chat_history.temp_inferred_answer
+    answer_id = chat_history.temp_inferred_answer_id
+    key = chat_history.temp_stack_key
+    chat_history.temp_next_q_id = None
+    chat_history.temp_inferred_answer = None
+    chat_history.temp_inferred_answer_id = None
+    chat_history.temp_stack_key = None
+    if not next_qid or key != speculation_key(chat_history):
+        return
+    if answer_id is None or not chat_history.stack or chat_history.stack[-1] != next_qid:
+        return
+
+    chat_history.stack.pop()
+    logger.info(f"Auto-answering {next_qid} with {answer_id} from speculative inference")
+    record_inferred_answer(chat_history, next_qid, inferred_text, answer_id, "speculation")
+
+@tracing.traced
+async def lookahead_answers(chat_history: ChatHistory) -> Dict[str, Tuple[Optional[str], str]]:
+    """Ask in one call which of the next LOOKAHEAD_DEPTH stacked questions the history already answers.
+
+    Returns ``{question_id: (evidence, answer_id)}`` for confident, valid answers only.
+    """
+    questions = [
+        get_question(chat_history, qid) for qid in reversed(chat_history.stack[-LOOKAHEAD_DEPTH:])
+    ]
+    questions = [q for q in questions if q.type == "valinta" and q.answers]
+    if not questions:
+        return {}
+    questions_str = "\n\n".join(
+        f"Question {q.question_id}: {q.text}\nOptions (ID → Text):\n"
+        + "\n".join(f"- {answer.answer_id}: {answer.text}" for answer in q.answers)
+        for q in questions
     )
+    lookahead_prompt = prompts["lookahead_answers"]
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
+        result = await llm.complete_json(
+            "lookahead_answers",
+            [
+                {"role": "system", "content": lookahead_prompt["system"]},
+                *conversation_messages(chat_history),
+                {"role": "user", "content": lookahead_prompt["user"].format(questions=questions_str)},
             ],
-            temperature=0.0,
-            max_tokens=500
+            lookahead_prompt["response_schema"],
+            max_tokens=150 * len(questions)
         )
-        return response.choices[0].message.content
     except Exception as e:
-        logger.error(f"Error summarizing conversation: {e}")
-        return "Error summarizing conversation"
+        logger.error(f"Error in lookahead for session {chat_history.session_id}: {e}")
+        return {}
 
-def process_valinta_answer(question: Question, user_answer: str) -> Tuple[str, List[Dict], Optional[str]]:
-    valid_answers = {answer["answerId"]: answer for answer in question.answers}
-    descriptions = [answer["answerText"]["FI"] for answer in question.answers]
-    options_str = ", ".join([f"{desc}: {aid}" for desc, aid in zip(descriptions, valid_answers.keys())])
+    asked = {q.question_id for q in questions}
+    answers = {}
+    for item in result["answers"]:
+        qid, answer_id = item["question_id"], item["answer_id"]
+        if qid not in asked or answer_id is None or item["confidence"] < LOOKAHEAD_MIN_CONFIDENCE:
+            continue
+        if answer_id in get_prompt_plan(chat_history, qid).answer_texts:
+            answers[qid] = (item["evidence"], answer_id)
+    logger.info(f"Lookahead over {len(questions)} questions answered {sorted(answers)} for session {chat_history.session_id}")
+    return answers
 
-    map_prompt = prompts["map_answer"]
-    system_message = map_prompt["system"]
-    user_message = map_prompt["user"].format(
-        question_text=question.questionText["FI"],
-        user_answer=user_answer,
-        options=options_str
+async def fast_forward(chat_history: ChatHistory) -> None:
+    """Auto-answer stacked questions the lookahead resolved, until the next one needs the patient.
+
+    Stops at the first question without a confident answer, including any
+    follow-up question an auto-answer opened, since those were not part of
+    the batch.
+    """
+    if LOOKAHEAD_DEPTH <= 0 or not chat_history.stack:
+        return
+    answers = await lookahead_answers(chat_history)
+    while chat_history.stack and chat_history.stack[-1] in answers:
+        qid = chat_history.stack.pop()
+        inferred_text, answer_id = answers.pop(qid)
+        record_inferred_answer(chat_history, qid, inferred_text, answer_id, "lookahead")
+
+def summary_lines(entries: List[Dict[str, Any]]) -> List[str]:
+    return [
+        f"{entry['question_text']}: {entry['user_answer']}"
+        for entry in entries
+        if not entry.get("re_ask") and entry["question_id"] != "summary"
+    ]
+
+def summary_messages(draft: str, lines: List[str]) -> List[Dict[str, str]]:
+    summary_prompt = prompts["update_summary"]
+    system_message = summary_prompt["system"]
+    user_message = summary_prompt["user"].format(
+        summary=draft or "(nothing yet)",
+        new_answers="\n".join(lines)
     )
-    response_schema = map_prompt["response_schema"]
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message}
+    ]
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "map_answer_response",
-                    "schema": response_schema,
-                    "strict": True
-                }
-            },
-            temperature=0.0,
-            max_tokens=150
-        )
-        result = json.loads(response.choices[0].message.content)
-        answer_id = result["answer_id"]
+def summary_draft(chat_history: ChatHistory) -> str:
+    return " ".join(chat_history.summary_parts)
 
-        if not answer_id or answer_id not in valid_answers:
-            return "", [], None
+@tracing.traced
+async def update_summary_draft(session_id: str) -> None:
+    """Fold the entries answered since the last update into the session's summary draft.
 
-        answer = valid_answers[answer_id]
-        formatted_text = answer["answerText"]["FI"].replace("__", user_answer)
-        return formatted_text, answer.get("question", []), answer_id
+    Runs as a background task after each ongoing turn. The model only writes
+    the text for the new entries, which is appended to the draft as a new
+    part, so both the updates and the final step stay short however long the
+    session gets. The parts are journaled like chatHistory entries: a save
+    writes only the new part, not the whole draft.
+    """
+    chat_history = await load_chat_history(session_id)
+    if not chat_history or not chat_history.current_question_id:
+        return
+    await preload_pinned_tree(chat_history)
+    start, end = chat_history.summary_parts_upto, len(chat_history.chatHistory)
+    lines = summary_lines(chat_history.chatHistory[start:end])
+    addition = ""
+    if lines:
+        try:
+            addition = await llm.complete_text(
+                "update_summary", summary_messages(summary_draft(chat_history), lines), max_tokens=200
+            )
+        except Exception as e:
+            logger.error(f"Error updating summary draft for session {session_id}: {e}")
+            return
 
+    try:
+        async with session_locks.hold(session_id, SESSION_LOCK_TIMEOUT):
+            latest = await load_chat_history(session_id)
+            if not latest or latest.summary_parts_upto != start:
+                return  # another update got there first
+            if addition.strip():
+                latest.summary_parts.append(addition.strip())
+            latest.summary_parts_upto = end
+            await save_chat_history(latest)
+    except TimeoutError as e:
+        logger.warning(f"Dropping summary draft update: {e}")
+
+async def stream_summary(chat_history: ChatHistory) -> AsyncIterator[str]:
+    """Final summary: the stored draft first, then the text for whatever the draft does not cover yet.
+
+    Without a draft this summarizes the whole conversation. If the model
+    fails, the uncovered answers are appended as plain facts instead.
+    """
+    draft = summary_draft(chat_history)
+    lines = summary_lines(chat_history.chatHistory[chat_history.summary_parts_upto:])
+    if draft:
+        yield draft
+    if not lines:
+        return
+    produced = False
+    try:
+        async for delta in llm.stream_text(
+            "update_summary", summary_messages(draft, lines), max_tokens=200 if draft else 500
+        ):
+            if not produced and draft:
+                delta = " " + delta.lstrip()
+            produced = True
+            yield delta
     except Exception as e:
-        logger.error(f"Error processing valinta answer: {e}")
-        return "", [], None
+        logger.error(f"Error streaming conversation summary: {e}")
+    if not produced:
+        facts = [conversation_context.entry_fact(entry) for entry in chat_history.chatHistory[chat_history.summary_parts_upto:]]
+        facts = [fact for fact in facts if fact]
+        yield ((" " if draft else "") + "; ".join(facts)) if facts else ("" if draft else "Error summarizing conversation")
 
-def process_ligert_answer(question: Question, user_answer: str) -> Tuple[str, List[Dict], Optional[str]]:
-    valid_answers = {
-        str(i): {"answerId": str(i), "answerText": {"FI": desc}}
-        for i, desc in {
-            "1": "Erittäin lievä kipu",
-            "2": "Hyvin lievä kipu",
-            "3": "Lievä kipu",
-            "4": "Epämiellyttävä kipu",
-            "5": "Kohtalainen kipu",
-            "6": "Häiritsevä kipu",
-            "7": "Kova kipu",
-            "8": "Erittäin kova kipu",
-            "9": "Sietämätön kipu",
-            "10": "Erittäin sietämätön kipu",
-            "-1": "käyttäjä ei vastannut selkeästi / yhden kirjaimen vastaus",
-        }.items()
-    }
-    options_str = ", ".join([f"{v['answerText']['FI']}: {k}" for k, v in valid_answers.items()])
+@tracing.traced
+async def get_summary(chat_history: ChatHistory) -> str:
+    return "".join([delta async for delta in stream_summary(chat_history)])
 
-    map_prompt = prompts["map_answer"]
-    system_message = map_prompt["system"]
-    user_message = map_prompt["user"].format(
-        question_text=question.questionText["FI"],
-        user_answer=user_answer,
-        options=options_str
+@tracing.traced
+async def map_answer_with_llm(question: QuestionNode, plan: PromptPlan, user_answer: str) -> Optional[str]:
+    """Ask the map_answer prompt for an answer id, consulting the shared cache first.
+
+    Null results are cached too, so a repeated unclear answer does not cost another call.
+    The system and per-question context messages come first and never change for a
+    question, so the provider can reuse its cached prompt prefix across patients.
+    """
+    # Question ids repeat across trees, so the key covers the question text and options, not just the id.
+    cache_key = llm_cache.make_key(
+        "map_answer",
+        plan.context_digest,
+        answer_matcher.normalize_answer(user_answer)
     )
-    response_schema = map_prompt["response_schema"]
+    hit, answer_id = await asyncio.to_thread(llm_cache.get, cache_key)
+    metrics.LLM_CACHE.labels("map_answer", "hit" if hit else "miss").inc()
+    if hit:
+        logger.info(f"LLM cache hit for map_answer on question {question.question_id}: {answer_id}")
+        return answer_id
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "map_answer_response",
-                    "schema": response_schema,
-                    "strict": True
-                }
-            },
-            temperature=0.0,
-            max_tokens=150
-        )
-        result = json.loads(response.choices[0].message.content)
-        answer_id = result["answer_id"]
+    map_prompt = prompts["map_answer"]
+    result = await llm.complete_json(
+        "map_answer",
+        [
+            {"role": "system", "content": map_prompt["system"]},
+            {"role": "user", "content": plan.context_message},
+            {"role": "user", "content": map_prompt["user"].format(user_answer=user_answer)}
+        ],
+        plan.schema,
+        max_tokens=150
+    )
+    answer_id = result["answer_id"]
+    await asyncio.to_thread(llm_cache.set, cache_key, answer_id)
+    return answer_id
 
-        if not answer_id or answer_id not in valid_answers:
-            logger.warning(f"Invalid answer_id: {answer_id} for ligert question {question.questionId}")
+async def process_valinta_answer(question: QuestionNode, user_answer: str, plan: PromptPlan, numbered: bool = False) -> Tuple[str, List[str], Optional[str]]:
+    answer_id = None
+    if numbered:
+        answer_id = answer_matcher.match_ordinal(question.question_id, plan.choices, user_answer)
+    if answer_id is None:
+        answer_id = answer_matcher.match_choice(question.question_id, plan.choices, user_answer)
+    if answer_id is None:
+        try:
+            answer_id = await map_answer_with_llm(question, plan, user_answer)
+        except llm.LLMUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing valinta answer: {e}")
             return "", [], None
 
-        answer = valid_answers[answer_id]
-        formatted_text = answer["answerText"]["FI"].replace("__", user_answer)
-        return formatted_text, answer.get("question", []), answer_id
+    if not answer_id or answer_id not in plan.answer_texts:
+        return "", [], None
 
-    except Exception as e:
-        logger.error(f"Error processing ligert answer: {e}")
+    formatted_text = plan.answer_texts[answer_id].replace("__", user_answer)
+    return formatted_text, list(plan.answer_children[answer_id]), answer_id
+
+async def process_ligert_answer(question: QuestionNode, user_answer: str, plan: PromptPlan, numbered: bool = False) -> Tuple[str, List[str], Optional[str]]:
+    # The scale values are their own numbers, so numbered choices need no special handling.
+    answer_id = answer_matcher.match_scale(question.question_id, user_answer)
+    if answer_id is None:
+        try:
+            answer_id = await map_answer_with_llm(question, plan, user_answer)
+        except llm.LLMUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing ligert answer: {e}")
+            return "", [], None
+
+    if not answer_id or answer_id not in LIGERT_SCALE:
+        logger.warning(f"Invalid answer_id: {answer_id} for ligert question {question.question_id}")
         return "", [], None
 
-def process_answer(question: Question, user_answer: str) -> Tuple[str, List[Dict], Optional[str]]:
+    formatted_text = LIGERT_SCALE[answer_id].replace("__", user_answer)
+    return formatted_text, [], answer_id
+
+async def process_answer(question: QuestionNode, user_answer: str, plan: PromptPlan, numbered: bool = False) -> Tuple[str, List[str], Optional[str]]:
     processors = {
         "valinta": process_valinta_answer,
         "ligert": process_ligert_answer,
@@ -359,7 +662,7 @@ def process_answer(question: Question, user_answer: str) -> Tuple[str, List[Dict
     print(f"Processing question type: {question.type} with user answer: {user_answer}")
     if not processor:
         raise ValueError(f"Unsupported question type: {question.type}")
-    return processor(question, user_answer)
+    return await processor(question, user_answer, plan, numbered)
 
 @app.get("/new-chat", response_model=InstanceResponse)
 async def new_chat() -> InstanceResponse:
@@ -373,7 +676,7 @@ async def new_chat() -> InstanceResponse:
     )
     question_text = INITIAL_QUESTION["questionText"]["FI"]
     status = "ongoing"
-    save_chat_history(chat_history)
+    await save_chat_history(chat_history)
     logger.info(f"New chat session started: {session_id}")
     return InstanceResponse(
         session_id=session_id,
@@ -382,7 +685,7 @@ async def new_chat() -> InstanceResponse:
         status=status
     )
 
-def create_new_chat(session_id: str) -> InstanceResponse:
+async def create_new_chat(session_id: str) -> InstanceResponse:
     chat_history = ChatHistory(
         session_id=session_id,
         stack=[],
@@ -392,7 +695,7 @@ def create_new_chat(session_id: str) -> InstanceResponse:
     )
     question_text = INITIAL_QUESTION["questionText"]["FI"]
     status = "ongoing"
-    save_chat_history(chat_history)
+    await save_chat_history(chat_history)
     logger.info(f"New chat session started: {session_id}, question_text: {question_text}")
     return InstanceResponse(
         session_id=session_id,
@@ -403,7 +706,7 @@ def create_new_chat(session_id: str) -> InstanceResponse:
 
 @app.get("/get-conversation-history/{session_id}", response_model=ChatHistory)
 async def get_conversation_history(session_id: str) -> ChatHistory:
-    chat_history = load_chat_history(session_id)
+    chat_history = await load_chat_history(session_id)
     if not chat_history:
         raise HTTPException(status_code=404, detail="Session not found")
     return chat_history
@@ -419,16 +722,92 @@ def get_json_tree(name: str):
 
 @app.get("/get-json-tree-names", response_model=List[str])
 def get_json_tree_names():
-    json_folder = Path(JSON_TREES_DIR)
-    if not json_folder.exists():
-        return []
-    return [f.stem for f in json_folder.glob("*.json")]
+    return tree_registry.names()
 
-@app.post("/handle-answer", response_model=InstanceResponse)
-async def handle_answer(request: InstanceRequest) -> InstanceResponse:
-    chat_history = load_chat_history(request.session_id)
+def summary_pending(chat_history: ChatHistory) -> bool:
+    """True once the stack is exhausted but the summary entry has not been stored yet."""
+    return (
+        chat_history.current_question_id is None
+        and bool(chat_history.chatHistory)
+        and chat_history.chatHistory[-1]["question_id"] != "summary"
+    )
+
+def append_summary(chat_history: ChatHistory, summary: str) -> None:
+    chat_history.chatHistory.append({
+        "question_id": "summary",
+        "question_text": summary,
+        "user_answer": "",
+        "chosen_answer": "",
+        "answer_id": None,
+        "timestamp": str(time.time()),
+        "inferred": False,
+        "re_ask": False,
+        "skipped": False
+    })
+
+async def finish_turn(chat_history: ChatHistory, request: InstanceRequest, response: InstanceResponse) -> InstanceResponse:
+    """Save the session together with the response, so a retry of the same request gets it back."""
+    chat_history.last_request_id = request.request_id
+    chat_history.last_response = response.model_dump()
+    await save_chat_history(chat_history)
+    return response
+
+def numbered_choices(chat_history: ChatHistory, question: QuestionNode) -> List[Dict[str, str]]:
+    """Options of ``question`` as numbered buttons; answering with the number needs no LLM."""
+    choices = get_prompt_plan(chat_history, question.question_id).choices
+    if question.type == "ligert":
+        choices = [(answer_id, text) for answer_id, text in choices if answer_id != "-1"]
+    return [{"id": str(i), "answer_id": answer_id, "text": text} for i, (answer_id, text) in enumerate(choices, 1)]
+
+def question_with_choices(chat_history: ChatHistory, question: QuestionNode) -> Tuple[str, List[str]]:
+    chat_history.choice_question_id = question.question_id
+    choices = numbered_choices(chat_history, question)
+    listed = "\n".join(f"{choice['id']}. {choice['text']}" for choice in choices)
+    # Clients that only render the question text still see the numbered options.
+    return f"{question.text}\n\n{listed}\n\nVastaa vaihtoehdon numerolla.", choices
+
+async def degraded_reask(chat_history: ChatHistory, request: InstanceRequest, question: QuestionNode, error: Exception) -> InstanceResponse:
+    """Ask ``question`` again as numbered choices because the answer could not be mapped without the LLM."""
+    logger.warning(f"LLM unavailable for {question.question_id} in session {request.session_id}, asking with choices: {error}")
+    metrics.REASKS.labels(chat_history.selected_tree or DEFAULT_TREE, "llm_unavailable").inc()
+    question_text, choices = question_with_choices(chat_history, question)
+    chat_history.chatHistory.append({
+        "question_id": question.question_id,
+        "question_text": question.text,
+        "user_answer": None,
+        "chosen_answer": None,
+        "answer_id": None,
+        "timestamp": str(time.time()),
+        "inferred": False,
+        "re_ask": True,
+        "skipped": False
+    })
+    return await finish_turn(chat_history, request, InstanceResponse(
+        session_id=request.session_id,
+        question=question_text,
+        answer="",
+        status="ongoing",
+        choices=choices
+    ))
+
+@tracing.traced
+async def handle_turn(request: InstanceRequest) -> Tuple[InstanceResponse, Optional[ChatHistory]]:
+    """Apply one user answer and persist the resulting state. Callers hold the session lock.
+
+    When the answer ends the conversation the summary is not generated here:
+    the saved session is returned alongside the response so the caller can
+    produce the summary (in one piece or streamed) and then store it with
+    finish_turn.
+    """
+    chat_history = await load_chat_history(request.session_id)
     if not chat_history:
-        return create_new_chat(request.session_id)
+        return await create_new_chat(request.session_id), None
+    await asyncio.to_thread(activity.touch, request.session_id)
+    await preload_pinned_tree(chat_history)
+
+    if request.request_id and request.request_id == chat_history.last_request_id and chat_history.last_response:
+        logger.info(f"Replaying response to duplicate request {request.request_id} for session {request.session_id}")
+        return InstanceResponse(**chat_history.last_response), None
 
     if not hasattr(chat_history, 'retry_counts'):
         chat_history.retry_counts = {}
@@ -441,17 +820,16 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
         if not available_trees:
             raise HTTPException(status_code=500, detail="No question trees available")
         
-        selected_tree, explanation = select_question_tree(user_answer, available_trees)
-        selected_tree = "VATSAOIREET"
+        selected_tree, explanation = await select_question_tree(user_answer, available_trees)
         logger.info(f"Selected tree: {selected_tree}, Explanation: {explanation}")
         if not selected_tree or selected_tree not in available_trees:
             raise HTTPException(status_code=500, detail="Failed to select a valid question tree")
         
-        question_tree = load_question_tree(f"{selected_tree}.json")
-        #question_map.update(build_question_map(question_tree))
-        
+        question_tree = tree_registry.tree(selected_tree)
+
         chat_history.selected_tree = selected_tree
-        chat_history.stack = list(question_tree.keys())[::-1]
+        chat_history.tree_version = question_tree.version
+        chat_history.stack = question_tree.root_ids[::-1]
         chat_history.chatHistory.append({
             "question_id": "initial_question",
             "question_text": INITIAL_QUESTION["questionText"]["FI"],
@@ -463,45 +841,61 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
             "re_ask": False,
             "skipped": False
         })
+        # 首条消息常常已经包含了后续问题的答案, 但短的开场白(如 "vatsa kipee")不值得多一次 LLM 调用
+        if len(user_answer.split()) >= LOOKAHEAD_MIN_WORDS:
+            await fast_forward(chat_history)
         
         if chat_history.stack:
             chat_history.current_question_id = chat_history.stack.pop()
-            question_text = question_map[chat_history.current_question_id].questionText["FI"]
+            question_text = get_question(chat_history, chat_history.current_question_id).text
             status = "ongoing"
         else:
             chat_history.current_question_id = None
             question_text = "No questions available in selected tree"
             status = "complete"
         
-        save_chat_history(chat_history)
-        return InstanceResponse(
+        return await finish_turn(chat_history, request, InstanceResponse(
             session_id=request.session_id,
             question=question_text,
             answer="",
             status=status
-        )
+        )), None
     
     # 处理后续问题
     if not chat_history.current_question_id:
+        if summary_pending(chat_history):
+            # A previous final turn stored the last answer but never got to store its summary.
+            return InstanceResponse(
+                session_id=request.session_id,
+                question="",
+                answer="",
+                status="complete"
+            ), chat_history
         return InstanceResponse(
             session_id=request.session_id,
             question="Conversation complete",
             answer="",
             status="complete"
-        )
+        ), None
     
     current_qid = chat_history.current_question_id
-    current_question = question_map[current_qid]
+    current_question = get_question(chat_history, current_qid)
+    numbered = chat_history.choice_question_id == current_qid
+    chat_history.choice_question_id = None
     
     if current_question.type == "ligert":
-        formatted_text, sub_qs, answer_id = process_ligert_answer(current_question, user_answer)
+        try:
+            formatted_text, sub_qs, answer_id = await process_ligert_answer(current_question, user_answer, get_prompt_plan(chat_history, current_qid), numbered)
+        except llm.LLMUnavailable as e:
+            return await degraded_reask(chat_history, request, current_question, e), None
         if answer_id == "-1":
             retries = chat_history.retry_counts.get(current_qid, 0)
             if retries < 99:
                 chat_history.retry_counts[current_qid] = retries + 1
+                metrics.REASKS.labels(chat_history.selected_tree, "unclear").inc()
                 chat_history.chatHistory.append({
                     "question_id": current_qid,
-                    "question_text": current_question.questionText["FI"],
+                    "question_text": current_question.text,
                     "user_answer": None,
                     "chosen_answer": None,
                     "answer_id": None,
@@ -510,16 +904,15 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
                     "re_ask": True,
                     "skipped": False
                 })
-                save_chat_history(chat_history)
-                return InstanceResponse(
+                return await finish_turn(chat_history, request, InstanceResponse(
                     session_id=request.session_id,
-                    question=current_question.questionText["FI"],
+                    question=current_question.text,
                     answer="",
                     status="ongoing"
-                )
+                )), None
         chat_history.chatHistory.append({
             "question_id": current_qid,
-            "question_text": current_question.questionText["FI"],
+            "question_text": current_question.text,
             "user_answer": f"User said: {user_answer}, we determined that to mean ligert scale number {answer_id}",
             "chosen_answer": formatted_text,
             "answer_id": answer_id,
@@ -529,19 +922,23 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
             "skipped": False
         })
         chat_history.retry_counts.pop(current_qid, None)
-        chat_history.stack.extend(q["questionId"] for q in sub_qs[::-1])
+        chat_history.stack.extend(sub_qs[::-1])
     
     # 2b) Other types: use mapping + retry
     else:
-        formatted_text, sub_qs, answer_id = process_valinta_answer(current_question, user_answer)
+        try:
+            formatted_text, sub_qs, answer_id = await process_valinta_answer(current_question, user_answer, get_prompt_plan(chat_history, current_qid), numbered)
+        except llm.LLMUnavailable as e:
+            return await degraded_reask(chat_history, request, current_question, e), None
         logger.info(f"Processed answer for question {current_qid}: {formatted_text}, sub questions: {sub_qs}, answer_id: {answer_id}")
         if answer_id is None:
             retries = chat_history.retry_counts.get(current_qid, 0)
             if retries < 99:
                 chat_history.retry_counts[current_qid] = retries + 1
+                metrics.REASKS.labels(chat_history.selected_tree, "unclear").inc()
                 chat_history.chatHistory.append({
                     "question_id": current_qid,
-                    "question_text": current_question.questionText["FI"],
+                    "question_text": current_question.text,
                     "user_answer": None,
                     "chosen_answer": None,
                     "answer_id": None,
@@ -550,18 +947,18 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
                     "re_ask": True,
                     "skipped": False
                 })
-                save_chat_history(chat_history)
-                return InstanceResponse(
+                return await finish_turn(chat_history, request, InstanceResponse(
                     session_id=request.session_id,
-                    question=current_question.questionText["FI"],
+                    question=current_question.text,
                     answer="",
                     status="ongoing"
-                )
+                )), None
             else:
                 chat_history.retry_counts.pop(current_qid, None)
+                metrics.SKIPS.labels(chat_history.selected_tree).inc()
                 chat_history.chatHistory.append({
                     "question_id": current_qid,
-                    "question_text": current_question.questionText["FI"],
+                    "question_text": current_question.text,
                     "user_answer": None,
                     "chosen_answer": None,
                     "answer_id": None,
@@ -573,7 +970,7 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
         else:
             chat_history.chatHistory.append({
                 "question_id": current_qid,
-                "question_text": current_question.questionText["FI"],
+                "question_text": current_question.text,
                 "user_answer": user_answer,
                 "chosen_answer": formatted_text,
                 "answer_id": answer_id,
@@ -582,36 +979,127 @@ async def handle_answer(request: InstanceRequest) -> InstanceResponse:
                 "re_ask": False,
                 "skipped": False
             })
-            chat_history.stack.extend(q["questionId"] for q in sub_qs[::-1])
+            chat_history.stack.extend(sub_qs[::-1])
     
+    apply_speculation(chat_history)
+    if len(user_answer.split()) >= LOOKAHEAD_MIN_WORDS:
+        await fast_forward(chat_history)
+    choices = None
     if chat_history.stack:
         next_qid = chat_history.stack.pop()
         chat_history.current_question_id = next_qid
-        question_text = question_map[next_qid].questionText["FI"]
+        next_question = get_question(chat_history, next_qid)
+        question_text = next_question.text
+        if not llm.available():
+            # Circuit open: offer buttons up front so the answer maps locally.
+            question_text, choices = question_with_choices(chat_history, next_question)
         status = "ongoing"
     else:
         chat_history.current_question_id = None
-        question_text = get_summary(chat_history.chatHistory)
-        chat_history.chatHistory.append({
-            "question_id": "summary",
-            "question_text": question_text,
-            "user_answer": "",
-            "chosen_answer": "",
-            "answer_id": None,
-            "timestamp": str(time.time()),
-            "inferred": False,
-            "re_ask": False,
-            "skipped": False
-        })
+        question_text = ""
         status = "complete"
     
-    save_chat_history(chat_history)
-    return InstanceResponse(
+    response = InstanceResponse(
         session_id=request.session_id,
         question=question_text,
         answer=formatted_text if 'formatted_text' in locals() else "",
-        status=status
+        status=status,
+        choices=choices
+    )
+    if status == "complete":
+        # Not remembered yet: a retry before the summary is stored must produce it.
+        await save_chat_history(chat_history)
+        return response, chat_history
+    return await finish_turn(chat_history, request, response), None
+
+async def run_in_background(work, session_id: str) -> None:
+    with metrics.background():
+        await work(session_id)
+
+def schedule_background_work(response: InstanceResponse, background_tasks: BackgroundTasks) -> None:
+    if response.status != "ongoing":
+        return
+    if SPECULATIVE_INFERENCE:
+        background_tasks.add_task(run_in_background, speculate_next_answer, response.session_id)
+    if SUMMARY_DRAFTS:
+        background_tasks.add_task(run_in_background, update_summary_draft, response.session_id)
+
+def with_idempotency_key(request: InstanceRequest, idempotency_key: Optional[str]) -> InstanceRequest:
+    if idempotency_key:
+        request.request_id = idempotency_key
+    return request
+
+@app.post("/handle-answer", response_model=InstanceResponse)
+async def handle_answer(
+    request: InstanceRequest,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(default=None)
+) -> InstanceResponse:
+    request = with_idempotency_key(request, idempotency_key)
+    try:
+        with metrics.TURN_SECONDS.labels("handle_answer").time():
+            async with session_locks.hold(request.session_id, SESSION_LOCK_TIMEOUT):
+                response, finished = await handle_turn(request)
+                if finished is not None:
+                    response.question = await get_summary(finished)
+                    append_summary(finished, response.question)
+                    await finish_turn(finished, request, response)
+    except TimeoutError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    schedule_background_work(response, background_tasks)
+    return response
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_turn(request: InstanceRequest, background_tasks: BackgroundTasks) -> AsyncIterator[str]:
+    # The whole turn runs inside the stream so the session lock is held until the summary is stored.
+    started = time.perf_counter()
+    try:
+        async with session_locks.hold(request.session_id, SESSION_LOCK_TIMEOUT):
+            response, finished = await handle_turn(request)
+            if finished is not None:
+                parts = []
+                async for delta in stream_summary(finished):
+                    parts.append(delta)
+                    yield sse_event("summary", {"delta": delta})
+                response.question = "".join(parts)
+                # Only a fully streamed summary is stored; if the client goes away first,
+                # the next call to either endpoint generates it again.
+                append_summary(finished, response.question)
+                await finish_turn(finished, request, response)
+    except TimeoutError as e:
+        yield sse_event("error", {"status_code": 409, "detail": str(e)})
+        return
+    except HTTPException as e:
+        yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        return
+    metrics.TURN_SECONDS.labels("handle_answer_stream").observe(time.perf_counter() - started)
+    schedule_background_work(response, background_tasks)
+    yield sse_event("response", response.model_dump())
+
+@app.post("/handle-answer-stream")
+async def handle_answer_stream(
+    request: InstanceRequest,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(default=None)
+) -> StreamingResponse:
+    """Same as /handle-answer, as Server-Sent Events.
+
+    Ongoing turns produce a single ``response`` event. The final turn first
+    streams the summary as ``summary`` events carrying text deltas, then sends
+    the complete InstanceResponse as the ``response`` event. Errors arrive as
+    an ``error`` event, since the status line has already been sent.
+    """
+    return StreamingResponse(
+        stream_turn(with_idempotency_key(request, idempotency_key), background_tasks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+@app.get("/metrics")
+def get_metrics() -> Response:
+    return Response(metrics.render(activity), media_type=metrics.CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
-    uvicorn.run("endpoint_new:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("endpoint_new:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,50 @@
+from utils.answer_matcher import match_choice, match_ordinal, match_scale
+
+YES_NO = [("1_1", "Kyllä"), ("1_2", "Ei")]
+YES_NO_MOJIBAKE = [("1_1", "Kyll�"), ("1_2", "Ei")]
+COUGH = [("4_1", "Ysk� on kuivaa"), ("4_2", "Ysk� on limaista")]
+
+
+def test_scale_accepts_digits_fractions_and_numerals():
+    assert match_scale("q", "7") == "7"
+    assert match_scale("q", "7/10") == "7"
+    assert match_scale("q", "VAS 3") == "3"
+    assert match_scale("q", "seitsemän") == "7"
+    assert match_scale("q", "Kymppi!") == "10"
+
+
+def test_scale_rejects_out_of_range_and_free_text():
+    assert match_scale("q", "0") is None
+    assert match_scale("q", "11") is None
+    assert match_scale("q", "7-8") is None
+    assert match_scale("q", "aika kova") is None
+
+
+def test_choice_matches_text_id_and_synonyms():
+    assert match_choice("1", YES_NO, "kyllä") == "1_1"
+    assert match_choice("1", YES_NO, "Joo.") == "1_1"
+    assert match_choice("1", YES_NO, "1_2") == "1_2"
+    assert match_choice("1", YES_NO, "ei ole") == "1_2"
+
+
+def test_choice_matches_mojibake_option_texts():
+    assert match_choice("1", YES_NO_MOJIBAKE, "kyllä") == "1_1"
+    assert match_choice("1", YES_NO_MOJIBAKE, "juu") == "1_1"
+    assert match_choice("4", COUGH, "yskä on kuivaa") == "4_1"
+
+
+def test_choice_leaves_finnish_fillers_and_free_text_to_the_llm():
+    # "no" is a Finnish filler ("no kyllä"), not a no.
+    assert match_choice("1", YES_NO, "no") is None
+    assert match_choice("1", YES_NO, "no kyllä") is None
+    assert match_choice("1", YES_NO, "en tiedä") is None
+    assert match_choice("1", YES_NO, "") is None
+    assert match_choice("4", COUGH, "kuivaa") is None
+
+
+def test_ordinal_maps_numbers_to_shown_choices():
+    assert match_ordinal("4", COUGH, "2.") == "4_2"
+    assert match_ordinal("4", COUGH, "yksi") == "4_1"
+    assert match_ordinal("4", COUGH, "3") is None
+    assert match_ordinal("4", COUGH, "0") is None
+    assert match_ordinal("4", COUGH, "kuiva") is None
@@ -0,0 +1,32 @@
+import json
+from pathlib import Path
+
+from utils.prompt_plans import build_prompt_plan
+from utils.question_nodes import build_node_table
+
+MAP_PROMPT = json.loads((Path(__file__).resolve().parent.parent / "prompts.json").read_text(encoding="utf-8"))["map_answer"]
+
+
+def yes_no_question(text):
+    return {
+        "questionId": "1",
+        "type": "valinta",
+        "questionText": {"FI": text},
+        "answers": [
+            {"answerId": "1_1", "answerText": {"FI": "Kyllä"}, "printText": "", "question": []},
+            {"answerId": "1_2", "answerText": {"FI": "Ei"}, "printText": "", "question": []},
+        ],
+    }
+
+
+def plan_for(text):
+    _, nodes = build_node_table([yes_no_question(text)])
+    return build_prompt_plan(nodes["1"], MAP_PROMPT)
+
+
+def test_same_id_and_options_in_different_questions_get_different_cache_digests():
+    diarrhea, cough = plan_for("Onko sinulla ripulia?"), plan_for("Onko sinulla yskää?")
+
+    assert diarrhea.options_str == cough.options_str
+    assert diarrhea.context_digest != cough.context_digest
+    assert plan_for("Onko sinulla ripulia?").context_digest == diarrhea.context_digest
@@ -0,0 +1,28 @@
+from utils.question_nodes import build_node_table
+
+
+def question(question_id, text, *follow_ups):
+    return {
+        "questionId": question_id,
+        "type": "valinta",
+        "questionText": {"FI": text},
+        "answers": [
+            {"answerId": f"{question_id}_{n}", "answerText": {"FI": f"Vastaus {n}"}, "printText": "", "question": list(children)}
+            for n, children in enumerate(follow_ups, 1)
+        ],
+    }
+
+
+def test_first_definition_of_a_duplicate_id_wins():
+    tree = [
+        question("1", "Ensimmäinen", [question("5", "FIRST", [question("6", "Syvä")])], []),
+        question("2", "Toinen", [question("5", "SECOND")]),
+        question("5", "THIRD"),
+    ]
+    root_ids, nodes = build_node_table(tree)
+
+    assert root_ids == ["1", "2", "5"]
+    assert nodes["5"].text == "FIRST"
+    # Pre-order, as excel/compile_trees.py numbers the compiled questions.
+    assert list(nodes) == ["1", "5", "6", "2"]
+    assert nodes["5"].answers[0].child_ids == ("6",)
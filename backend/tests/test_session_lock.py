@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+import pytest
+
+from utils.session_lock import SessionLocks, acquire_within
+
+
+def test_acquire_within_times_out_without_leaving_the_lock_held():
+    async def scenario():
+        lock = asyncio.Lock()
+        await lock.acquire()
+        assert not await acquire_within(lock, 0.01)
+        lock.release()
+        await asyncio.sleep(0)
+        assert not lock.locked()
+        assert await acquire_within(lock, 0.01)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_acquire_does_not_leave_the_lock_held():
+    async def scenario():
+        lock = asyncio.Lock()
+        await lock.acquire()
+        waiter = asyncio.ensure_future(acquire_within(lock, 10))
+        await asyncio.sleep(0.01)
+        lock.release()
+        waiter.cancel()  # races with the lock being handed over
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        assert not lock.locked()
+
+    asyncio.run(scenario())
+
+
+def test_same_session_waits_and_other_sessions_do_not(tmp_path):
+    locks = SessionLocks(str(tmp_path))
+
+    async def scenario():
+        async with locks.hold("a", 1):
+            with pytest.raises(TimeoutError):
+                async with locks.hold("a", 0.05):
+                    pass
+            async with locks.hold("b", 0.05):
+                pass
+        async with locks.hold("a", 0.05):
+            pass
+
+    asyncio.run(scenario())
+    assert os.listdir(tmp_path) == []
+    assert locks._local == {}
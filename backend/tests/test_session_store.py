@@ -0,0 +1,79 @@
+import json
+
+from utils.session_store import JOURNAL_COMPACT_EVERY, JournalSessionStore
+
+SESSION_ID = "3f0c2a9e-5b1d-4c8e-9a77-0d6e1f2b4c10"
+
+
+def session(turns: int) -> dict:
+    return {
+        "session_id": SESSION_ID,
+        "stack": [str(i) for i in range(turns, 0, -1)],
+        "current_question_id": str(turns),
+        "chatHistory": [
+            {"question_id": str(i), "question_text": f"Kysymys {i}", "user_answer": "kyllä ä" * i}
+            for i in range(turns)
+        ],
+    }
+
+
+def test_torn_writes_are_ignored_and_repaired(tmp_path):
+    store = JournalSessionStore(str(tmp_path))
+    store.save(SESSION_ID, session(2))
+    store.save(SESSION_ID, session(3))
+    state_path, turns_path = store._journal_paths(SESSION_ID)
+
+    # A crash in the middle of the next save: part of a turn, part of a state line.
+    with open(turns_path, "ab") as file:
+        file.write(b'{"question_id": "3", "question_te')
+    with open(state_path, "ab") as file:
+        file.write(b'{"session_id": "' + SESSION_ID.encode() + b'", "stack": [')
+
+    assert store.load(SESSION_ID) == session(3)
+
+    store.save(SESSION_ID, session(5))
+    assert store.load(SESSION_ID) == session(5)
+    with open(turns_path, "rb") as file:
+        lines = file.read().splitlines()
+    assert [json.loads(line) for line in lines] == session(5)["chatHistory"]
+
+
+def test_turns_without_a_state_line_are_not_committed(tmp_path):
+    store = JournalSessionStore(str(tmp_path))
+    store.save(SESSION_ID, session(2))
+    _, turns_path = store._journal_paths(SESSION_ID)
+
+    # Complete turn lines written, but the save died before its state line.
+    with open(turns_path, "ab") as file:
+        file.write(b'{"question_id": "stale"}\n{"question_id": "stale"}\n')
+
+    assert store.load(SESSION_ID) == session(2)
+    store.save(SESSION_ID, session(3))
+    assert store.load(SESSION_ID) == session(3)
+
+
+def test_state_file_is_compacted(tmp_path):
+    store = JournalSessionStore(str(tmp_path))
+    for turns in range(1, 2 * JOURNAL_COMPACT_EVERY + 3):
+        store.save(SESSION_ID, session(turns))
+    state_path, _ = store._journal_paths(SESSION_ID)
+
+    with open(state_path, "rb") as file:
+        assert len(file.read().splitlines()) < JOURNAL_COMPACT_EVERY
+    assert store.load(SESSION_ID) == session(2 * JOURNAL_COMPACT_EVERY + 2)
+
+
+def test_summary_parts_are_journaled_outside_the_state_line(tmp_path):
+    store = JournalSessionStore(str(tmp_path))
+    data = session(1)
+    data["summary_parts"] = []
+    for turns in range(2, 40):
+        data = dict(session(turns), summary_parts=data["summary_parts"] + [f"Osa {turns}: " + "kipua " * 40])
+        store.save(SESSION_ID, data)
+    state_path, _ = store._journal_paths(SESSION_ID)
+
+    with open(state_path, "rb") as file:
+        last_state = json.loads(file.read().splitlines()[-1])
+    assert "summary_parts" not in last_state
+    assert "kipua" not in json.dumps(last_state)
+    assert store.load(SESSION_ID) == data
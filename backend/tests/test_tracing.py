@@ -0,0 +1,52 @@
+import asyncio
+import os
+
+from utils import tracing
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(middleware, headers):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/x", "headers": headers}
+    asyncio.run(middleware(scope, None, send))
+    return dict(sent[0]["headers"])
+
+
+def make(tmp_path, debug_token):
+    return tracing.TracingMiddleware(
+        ok_app, str(tmp_path / "traces"), str(tmp_path / "profiles"), 0.0, 0.0, debug_token=debug_token
+    )
+
+
+def test_trace_header_is_ignored_without_a_debug_token(tmp_path):
+    response_headers = call(make(tmp_path, None), [(b"x-ars-trace", b"1")])
+
+    assert tracing.TRACE_ID_HEADER not in response_headers
+    assert not (tmp_path / "traces").exists()
+
+
+def test_trace_header_needs_the_debug_token(tmp_path):
+    middleware = make(tmp_path, "s3cret")
+
+    assert tracing.TRACE_ID_HEADER not in call(middleware, [(b"x-ars-trace", b"1")])
+    assert tracing.TRACE_ID_HEADER in call(middleware, [(b"x-ars-trace", b"s3cret")])
+    assert len(os.listdir(tmp_path / "traces")) == 1
+
+
+def test_prune_directory_removes_the_oldest_files_first(tmp_path):
+    for n in range(5):
+        path = tmp_path / f"{n}.pstats"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 + n, 1000 + n))
+
+    tracing.prune_directory(str(tmp_path), 250)
+
+    assert sorted(os.listdir(tmp_path)) == ["3.pstats", "4.pstats"]
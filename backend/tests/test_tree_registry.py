@@ -0,0 +1,49 @@
+import asyncio
+import json
+import time
+
+from utils.tree_registry import QuestionTree, TreeRegistry
+
+
+def build_tree(name, file_contents):
+    return QuestionTree(name, [q["questionId"] for q in file_contents], {q["questionId"]: q for q in file_contents})
+
+
+def write_tree(path, text):
+    path.write_text(json.dumps([{"questionId": "1", "questionText": {"FI": text}}]), encoding="utf-8")
+
+
+def test_version_superseded_after_a_long_time_as_current_is_not_evicted_at_once(tmp_path):
+    trees, archive = tmp_path / "trees", tmp_path / "archive"
+    trees.mkdir()
+    write_tree(trees / "kuume.json", "Vanha")
+    registry = TreeRegistry(str(trees), build_tree, str(archive))
+    registry.load()
+    old_version = registry.tree("kuume").version
+    # Current for longer than the idle window before the edit.
+    registry._last_used[("kuume", old_version)] = time.time() - 3600
+
+    write_tree(trees / "kuume.json", "Uusi")
+    assert registry.refresh() == ["kuume"]
+    registry.evict(idle_seconds=600)
+
+    assert ("kuume", old_version) in registry._versions
+    assert registry.question("kuume", "1", old_version)["questionText"]["FI"] == "Vanha"
+
+
+def test_preload_reads_an_evicted_version_from_the_archive(tmp_path):
+    trees, archive = tmp_path / "trees", tmp_path / "archive"
+    trees.mkdir()
+    write_tree(trees / "kuume.json", "Vanha")
+    registry = TreeRegistry(str(trees), build_tree, str(archive))
+    registry.load()
+    old_version = registry.tree("kuume").version
+    write_tree(trees / "kuume.json", "Uusi")
+    registry.refresh()
+    registry.evict(idle_seconds=-1)
+    assert ("kuume", old_version) not in registry._versions
+
+    asyncio.run(registry.preload("kuume", old_version))
+
+    assert ("kuume", old_version) in registry._versions
+    assert registry.question("kuume", "1", old_version)["questionText"]["FI"] == "Vanha"
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat-completions API, for load tests without real tokens.
+
+Answers every prompt in prompts.json with a response that is valid for its
+json_schema (or plain text for free-text prompts), after a simulated delay,
+and injects errors at configurable rates. Streaming requests get SSE chunks,
+plus a usage chunk when stream_options.include_usage is set.
+
+Usage (from backend/):
+    python -m tools.fake_openai --port 8100 --latency-median 0.8 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn endpoint_new:app --workers 5
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PROMPTS_PATH = "./prompts.json"
+FILLER_WORDS = (
+    "potilas kertoo oireista jotka ovat alkaneet muutama päivä sitten ja pahentuneet "
+    "vähitellen kipu on ajoittaista eikä helpota levolla"
+).split()
+
+app = FastAPI()
+config = argparse.Namespace()
+system_prompts: Dict[str, str] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def prompt_name(body: Dict[str, Any]) -> str:
+    response_format = body.get("response_format") or {}
+    name = (response_format.get("json_schema") or {}).get("name", "")
+    if name.endswith("_response"):
+        return name[:-len("_response")]
+    system = next((m["content"] for m in body.get("messages", []) if m["role"] == "system"), "")
+    return system_prompts.get(system, "unknown")
+
+
+def last_user_message(body: Dict[str, Any]) -> str:
+    return next((m["content"] for m in reversed(body.get("messages", [])) if m["role"] == "user"), "")
+
+
+def sample_instance(schema: Dict[str, Any]) -> Any:
+    """Generic value satisfying the subset of JSON schema that strict structured outputs allow."""
+    if "anyOf" in schema:
+        branches = [b for b in schema["anyOf"] if b.get("type") != "null"] or schema["anyOf"]
+        return sample_instance(random.choice(branches))
+    if "enum" in schema:
+        return random.choice(schema["enum"])
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {key: sample_instance(sub) for key, sub in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [sample_instance(schema.get("items", {})) for _ in range(random.randint(0, 2))]
+    if schema_type == "string":
+        return " ".join(random.sample(FILLER_WORDS, 4))
+    if schema_type == "number":
+        return round(random.random(), 2)
+    if schema_type == "integer":
+        return random.randint(0, 10)
+    if schema_type == "boolean":
+        return random.random() < 0.5
+    return None
+
+
+def option_ids(text: str) -> List[str]:
+    return re.findall(r"^- (\S+):", text, re.MULTILINE)
+
+
+def structured_answer(name: str, schema: Dict[str, Any], body: Dict[str, Any]) -> Any:
+    """Plausible answers for the known prompts; anything else gets a generic schema-valid instance."""
+    user = last_user_message(body)
+    if name == "select_tree":
+        match = re.search(r"Available question trees: (.*)", user)
+        trees = [t.strip() for t in match.group(1).split(",")] if match else ["VATSAOIREET"]
+        return {"selected_tree": random.choice(trees), "explanation": "fake"}
+    if name == "map_answer":
+        answer_id = schema["properties"]["answer_id"]
+        ids = next((b["enum"] for b in answer_id.get("anyOf", []) if "enum" in b), [])
+        return {"answer_id": random.choice(ids) if ids and random.random() >= config.null_rate else None}
+    if name == "infer_answer":
+        ids = option_ids(user)
+        if ids and random.random() < config.infer_rate:
+            return {"answer_found": True, "inferred_answer_text": "fake", "inferred_answer_id": random.choice(ids)}
+        return {"answer_found": False, "inferred_answer_text": None, "inferred_answer_id": None}
+    if name == "lookahead_answers":
+        answers = []
+        for match in re.finditer(r"^Question (\S+?):(.*?)(?=^Question |\Z)", user, re.MULTILINE | re.DOTALL):
+            question_id, ids = match.group(1), option_ids(match.group(2))
+            found = ids and random.random() < config.infer_rate
+            answers.append({
+                "question_id": question_id,
+                "answer_id": random.choice(ids) if found else None,
+                "evidence": "fake" if found else None,
+                "confidence": round(random.uniform(0.85, 1.0) if found else random.uniform(0.0, 0.5), 2),
+            })
+        return {"answers": answers}
+    return sample_instance(schema)
+
+
+def text_answer(max_tokens: int) -> str:
+    n_words = max(5, min(max_tokens // 2, 80))
+    return " ".join(random.choice(FILLER_WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def simulated_latency(completion_tokens: int) -> float:
+    base = random.lognormvariate(0.0, config.latency_sigma) * config.latency_median
+    return base + completion_tokens * config.per_token
+
+
+def injected_error() -> Optional[JSONResponse]:
+    roll = random.random()
+    if roll < config.rate_limit_rate:
+        return JSONResponse({"error": {"message": "Rate limit reached (fake)", "type": "requests"}}, status_code=429)
+    if roll < config.rate_limit_rate + config.error_rate:
+        return JSONResponse({"error": {"message": "Internal error (fake)", "type": "server_error"}}, status_code=500)
+    return None
+
+
+def completion_body(body: Dict[str, Any], content: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+async def stream_chunks(body: Dict[str, Any], content: str, prompt_tokens: int, completion_tokens: int):
+    chunk_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+    base = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "fake")}
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        delta = {"content": word if i == 0 else " " + word}
+        if i == 0:
+            delta["role"] = "assistant"
+        yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})}\n\n"
+        await asyncio.sleep(config.per_token * 2)
+    yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    if (body.get("stream_options") or {}).get("include_usage"):
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    name = prompt_name(body)
+    prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in body.get("messages", []))
+
+    error = injected_error()
+    if error is not None:
+        await asyncio.sleep(simulated_latency(0) / 2)
+        return error
+    if random.random() < config.stall_rate:
+        await asyncio.sleep(config.stall_seconds)
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        content = json.dumps(structured_answer(name, schema, body), ensure_ascii=False)
+    else:
+        content = text_answer(body.get("max_tokens") or 200)
+    completion_tokens = estimate_tokens(content)
+
+    if body.get("stream"):
+        await asyncio.sleep(simulated_latency(0))
+        return StreamingResponse(stream_chunks(body, content, prompt_tokens, completion_tokens),
+                                 media_type="text/event-stream")
+    await asyncio.sleep(simulated_latency(completion_tokens))
+    return completion_body(body, content, prompt_tokens, completion_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-median", type=float, default=0.8, help="median base latency, seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal sigma of the base latency")
+    parser.add_argument("--per-token", type=float, default=0.01, help="extra seconds per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction that first hang for --stall-seconds")
+    parser.add_argument("--stall-seconds", type=float, default=120.0)
+    parser.add_argument("--null-rate", type=float, default=0.1, help="fraction of map_answer calls that match nothing")
+    parser.add_argument("--infer-rate", type=float, default=0.2, help="chance an inference finds an answer")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    vars(config).update(vars(args))
+    random.seed(args.seed)
+    with open(PROMPTS_PATH, encoding="utf-8") as f:
+        system_prompts.update({p["system"]: name for name, p in json.load(f).items() if "system" in p})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test: simulated patients answer question trees end to end.
+
+Each patient opens a session with /new-chat and answers until the status is
+"complete". Answers are picked from the real option texts of the trees in
+../excel/json, so most turns take the local-match path; --free-text-rate of
+them are vague free text that needs the LLM. Run the backend against
+tools/fake_openai.py to load it without spending tokens.
+
+Usage (from backend/):
+    python -m tools.loadtest --base-url http://127.0.0.1:8000 --patients 200 --concurrency 50
+
+Reports throughput, turn latency percentiles, errors, and per-worker event
+loop stall time from /metrics (needs PROMETHEUS_MULTIPROC_DIR on the backend
+to see every worker, not just the one that answered the scrape).
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from utils.question_nodes import build_node_table
+
+JSON_TREES_DIR = "../excel/json"
+COMPLAINTS = [
+    "Minulla on ollut kovaa vatsakipua eilisestä asti",
+    "Oksettaa ja on huono olo",
+    "Kuumetta 38,5 ja yskää",
+    "Virtsatessa kirvelee",
+    "Ripulia on ollut kolme päivää",
+    "Korvaan sattuu ja nenä vuotaa",
+]
+FREE_TEXT = [
+    "en oikein osaa sanoa",
+    "ehkä vähän, mutta ei kovin paljon",
+    "joo kyllä se taitaa pitää paikkansa",
+    "ei ole huomannut mitään sellaista",
+    "aika kovaa, sanoisin seitsemän",
+]
+STALL_METRIC = re.compile(r'^ars_event_loop_stall_seconds_total\{worker="([^"]+)"\} ([0-9.eE+-]+)$', re.MULTILINE)
+LLM_METRIC = re.compile(r'^ars_llm_requests_total\{([^}]*)\} ([0-9.eE+-]+)$', re.MULTILINE)
+LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def load_question_options(trees_dir: str) -> Dict[str, Tuple[str, List[str]]]:
+    """{question text: (type, [answer texts])} over every tree; the API returns question text, not ids."""
+    options: Dict[str, Tuple[str, List[str]]] = {}
+    for filename in sorted(os.listdir(trees_dir)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(trees_dir, filename), encoding="utf-8") as f:
+            _, nodes = build_node_table(json.load(f))
+        for node in nodes.values():
+            texts = [answer.text for answer in node.answers if answer.text]
+            known_type, known = options.get(node.text, (node.type, []))
+            options[node.text] = (known_type, known + [t for t in texts if t not in known])
+    return options
+
+
+def pick_answer(response: Dict, options: Dict[str, Tuple[str, List[str]]], free_text_rate: float) -> str:
+    if response.get("choices"):
+        return random.choice(response["choices"])["id"]
+    question = response["question"].split("\n\n", 1)[0]
+    if question not in options:
+        return random.choice(COMPLAINTS)
+    question_type, texts = options[question]
+    if random.random() < free_text_rate:
+        return random.choice(FREE_TEXT)
+    if question_type == "ligert":
+        return str(random.randint(1, 10))
+    if texts:
+        return random.choice(texts)
+    return random.choice(FREE_TEXT)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {"new-chat": [], "handle-answer": []}
+        self.errors = Counter()
+        self.completed = 0
+        self.abandoned = 0
+
+
+async def run_patient(client: httpx.AsyncClient, options, stats: Stats, args) -> None:
+    started = time.perf_counter()
+    try:
+        response = await client.get("/new-chat")
+    except httpx.HTTPError as e:
+        stats.errors[type(e).__name__] += 1
+        return
+    stats.latencies["new-chat"].append(time.perf_counter() - started)
+    if response.status_code != 200:
+        stats.errors[f"new-chat {response.status_code}"] += 1
+        return
+    body = response.json()
+    session_id = body["session_id"]
+
+    for _ in range(args.max_turns):
+        if body["status"] == "complete":
+            stats.completed += 1
+            return
+        payload = {
+            "session_id": session_id,
+            "user_answer": pick_answer(body, options, args.free_text_rate),
+            "request_id": uuid.uuid4().hex,
+        }
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, args.think_time))
+        started = time.perf_counter()
+        try:
+            response = await client.post("/handle-answer", json=payload)
+        except httpx.HTTPError as e:
+            stats.errors[type(e).__name__] += 1
+            return
+        stats.latencies["handle-answer"].append(time.perf_counter() - started)
+        if response.status_code != 200:
+            stats.errors[f"handle-answer {response.status_code}"] += 1
+            return
+        body = response.json()
+    stats.abandoned += 1
+
+
+async def scrape(client: httpx.AsyncClient) -> Optional[str]:
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    return response.text if response.status_code == 200 else None
+
+
+def stall_by_worker(text: Optional[str]) -> Dict[str, float]:
+    return {worker: float(value) for worker, value in STALL_METRIC.findall(text or "")}
+
+
+def llm_calls(text: Optional[str]) -> Counter:
+    calls = Counter()
+    # Label order differs between single- and multiprocess exposition.
+    for labels, value in LLM_METRIC.findall(text or ""):
+        labels = dict(LABEL.findall(labels))
+        calls[(labels["prompt"], labels["outcome"])] += float(value)
+    return calls
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+async def main(args) -> None:
+    random.seed(args.seed)
+    options = load_question_options(args.trees_dir)
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        before = await scrape(client)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def patient():
+            async with semaphore:
+                await run_patient(client, options, stats, args)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(patient() for _ in range(args.patients)))
+        elapsed = time.perf_counter() - started
+        after = await scrape(client)
+
+    turns = stats.latencies["handle-answer"]
+    print(f"patients {args.patients} (concurrency {args.concurrency}): "
+          f"{stats.completed} complete, {stats.abandoned} hit --max-turns, {sum(stats.errors.values())} failed")
+    print(f"elapsed {elapsed:.1f}s, {len(turns)} turns, {len(turns) / elapsed:.1f} turns/s")
+    for endpoint, values in stats.latencies.items():
+        print(f"{endpoint:>14}: n={len(values)} p50={percentile(values, 50) * 1000:.0f}ms "
+              f"p95={percentile(values, 95) * 1000:.0f}ms p99={percentile(values, 99) * 1000:.0f}ms "
+              f"max={max(values, default=float('nan')) * 1000:.0f}ms")
+    for error, count in stats.errors.most_common():
+        print(f"  error {error}: {count}")
+
+    if after is None:
+        print("/metrics not reachable; no event loop or LLM figures")
+        return
+    stall_before, stall_after = stall_by_worker(before), stall_by_worker(after)
+    print("event loop stall per worker (s):")
+    for worker in sorted(stall_after):
+        print(f"  {worker}: {stall_after[worker] - stall_before.get(worker, 0.0):.3f}")
+    calls = llm_calls(after)
+    calls.subtract(llm_calls(before))
+    print("LLM calls:")
+    for (prompt, outcome), count in sorted(calls.items()):
+        if count:
+            print(f"  {prompt} {outcome}: {count:.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test with simulated patients")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--max-turns", type=int, default=80)
+    parser.add_argument("--free-text-rate", type=float, default=0.2, help="share of answers given as vague free text")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause before each answer, seconds")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--trees-dir", default=JSON_TREES_DIR)
+    parser.add_argument("--seed", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Replay stored transcripts through the engine in process and compare against a baseline.
+
+Every session under data/chatHistory (legacy *.json, sharded or journaled) is
+re-driven through the /handle-answer code path without HTTP: a new session is
+opened, the recorded first message is sent, and each question the engine asks
+is answered with what the patient answered to that question id. Background
+work (speculation, summary drafts) runs inline after each turn, so a replay is
+sequential and repeatable. Sessions, LLM cache, locks and activity go to a
+temporary directory; the source transcripts are only read.
+
+Reported per session: LLM calls (by prompt), tokens, re-asks, CPU and wall time
+per turn. For stable numbers record the LLM once and replay it from the cassette:
+
+    ARS_LLM_CASSETTE=record python -m tools.replay_sessions --save-baseline baseline.json
+    ARS_LLM_CASSETTE=replay ARS_LLM_CASSETTE_LATENCY=zero python -m tools.replay_sessions --baseline baseline.json
+
+Exits with status 1 when a metric is worse than the baseline beyond its tolerance.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import BackgroundTasks
+
+import endpoint_new as ep
+from utils import metrics
+from utils.llm_cache import LLMCache
+from utils.session_lock import SessionLocks
+from utils.session_store import JournalSessionStore, create_session_store
+
+LIGERT_ANSWER = re.compile(r"^User said: (.*), we determined that to mean ligert scale number", re.DOTALL)
+# Attempts at one question before the replay gives up on the session.
+MAX_ATTEMPTS = 3
+# (metric, tolerance key): relative increase over the baseline that counts as a regression.
+COMPARED = [
+    ("llm_calls_per_session", "count"),
+    ("tokens_per_session", "count"),
+    ("reasks_per_session", "count"),
+    ("answer_mismatches", "count"),
+    ("diverged_sessions", "count"),
+    ("turn_cpu_ms_p50", "time"),
+    ("turn_cpu_ms_p95", "time"),
+    ("turn_wall_ms_p50", "time"),
+    ("turn_wall_ms_p95", "time"),
+]
+
+
+class Transcript:
+    """
+    What a stored session tells us about the patient.
+
+    Attributes:
+        session_id (str): Id of the recorded session.
+        first_message (str): Answer to the initial question.
+        answers (Dict[str, List[str]]): Accepted free-text answers per question id, in order.
+        answer_ids (Dict[str, str]): Last answer id per question id, including inferred ones.
+    """
+    def __init__(self, session_id: str, data: Dict[str, Any]):
+        self.session_id = session_id
+        self.first_message = ""
+        self.answers: Dict[str, List[str]] = {}
+        self.answer_ids: Dict[str, str] = {}
+        for entry in data.get("chatHistory", []):
+            question_id = entry.get("question_id")
+            user_answer = entry.get("user_answer")
+            if question_id == "initial_question":
+                self.first_message = self.first_message or (user_answer or "")
+                continue
+            if entry.get("answer_id") is not None:
+                self.answer_ids[question_id] = entry["answer_id"]
+            if user_answer is None or entry.get("inferred"):
+                continue
+            match = LIGERT_ANSWER.match(user_answer)
+            self.answers.setdefault(question_id, []).append(match.group(1) if match else user_answer)
+
+
+def load_transcripts(root: str, limit: Optional[int]) -> List[Transcript]:
+    store = JournalSessionStore(root)
+    session_ids = set()
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(".state.jsonl"):
+                session_ids.add(filename[:-len(".state.jsonl")])
+            elif filename.endswith(".json") and not filename.startswith("."):
+                session_ids.add(filename[:-len(".json")])
+    transcripts = []
+    for session_id in sorted(session_ids):
+        try:
+            data = store.load(session_id)
+        except (OSError, ValueError) as e:
+            print(f"skipping {session_id}: {e}", file=sys.stderr)
+            continue
+        transcript = Transcript(session_id, data or {})
+        if transcript.first_message:
+            transcripts.append(transcript)
+        if limit and len(transcripts) >= limit:
+            break
+    return transcripts
+
+
+def isolate(workdir: str) -> None:
+    """Point the engine's session store, LLM cache, locks and activity tracker at ``workdir``."""
+    ep.session_store = create_session_store(
+        ep.SESSION_STORE, workdir, os.path.join(workdir, "chatHistory"), ep.SESSION_CACHE_SIZE
+    )
+    ep.llm_cache = LLMCache(
+        os.path.join(workdir, "llm_cache.sqlite"), ep.llm_cache.version, ep.LLM_CACHE_TTL, ep.LLM_CACHE_MAX_ENTRIES
+    )
+    ep.session_locks = SessionLocks(os.path.join(workdir, "locks"))
+    ep.activity = metrics.ActivityTracker(os.path.join(workdir, "activity.sqlite"), ep.ACTIVE_SESSION_WINDOW)
+
+
+def counter_values(counter) -> Dict[Tuple[str, ...], float]:
+    return {
+        tuple(sample.labels.values()): sample.value
+        for family in counter.collect() for sample in family.samples if sample.name.endswith("_total")
+    }
+
+
+def counter_delta(counter, before: Dict[Tuple[str, ...], float]) -> Dict[Tuple[str, ...], float]:
+    after = counter_values(counter)
+    return {labels: value - before.get(labels, 0.0) for labels, value in after.items() if value - before.get(labels, 0.0)}
+
+
+def next_answer(transcript: Transcript, chat_history: ep.ChatHistory, response: ep.InstanceResponse,
+                attempts: Dict[str, int]) -> Optional[str]:
+    """The patient's answer to the current question, or None if the transcript has nothing for it."""
+    question_id = chat_history.current_question_id
+    attempts[question_id] = attempts.get(question_id, 0) + 1
+    if attempts[question_id] > MAX_ATTEMPTS:
+        return None
+    answer_id = transcript.answer_ids.get(question_id)
+    if response.choices:
+        return next((choice["id"] for choice in response.choices if choice["answer_id"] == answer_id), None)
+    recorded = transcript.answers.get(question_id, [])
+    if attempts[question_id] <= len(recorded):
+        return recorded[attempts[question_id] - 1]
+    # Asked here but answered by inference (or not at all) in the recording: answer with the option itself.
+    question = ep.get_question(chat_history, question_id)
+    if question.type == "ligert":
+        return answer_id
+    return next((answer.text for answer in question.answers if answer.answer_id == answer_id), None)
+
+
+async def replay_session(transcript: Transcript, max_turns: int) -> Dict[str, Any]:
+    llm_before = counter_values(metrics.LLM_REQUESTS)
+    tokens_before = counter_values(metrics.LLM_TOKENS)
+    turn_cpu: List[float] = []
+    turn_wall: List[float] = []
+    attempts: Dict[str, int] = {}
+    status = "max_turns"
+
+    response = await ep.new_chat()
+    session_id = response.session_id
+    user_answer = transcript.first_message
+    for _ in range(max_turns):
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        background_tasks = BackgroundTasks()
+        response = await ep.handle_answer(ep.InstanceRequest(session_id=session_id, user_answer=user_answer),
+                                          background_tasks, None)
+        await background_tasks()
+        turn_cpu.append((time.process_time() - cpu_started) * 1000)
+        turn_wall.append((time.perf_counter() - wall_started) * 1000)
+        if response.status == "complete":
+            status = "complete"
+            break
+        chat_history = await ep.load_chat_history(session_id)
+        user_answer = next_answer(transcript, chat_history, response, attempts)
+        if user_answer is None:
+            status = f"diverged at {chat_history.current_question_id}"
+            break
+
+    chat_history = await ep.load_chat_history(session_id)
+    llm_calls = counter_delta(metrics.LLM_REQUESTS, llm_before)
+    return {
+        "session": transcript.session_id,
+        "status": status,
+        "turns": len(turn_cpu),
+        "llm_calls": int(sum(llm_calls.values())),
+        "llm_calls_by_prompt": {f"{prompt}/{outcome}": int(n) for (prompt, outcome), n in sorted(llm_calls.items())},
+        "tokens": int(sum(counter_delta(metrics.LLM_TOKENS, tokens_before).values())),
+        "reasks": sum(1 for entry in chat_history.chatHistory if entry.get("re_ask")),
+        # Questions both runs answered, but with a different option than the recording.
+        "answer_mismatches": sum(
+            1 for entry in chat_history.chatHistory
+            if entry.get("answer_id") is not None
+            and transcript.answer_ids.get(entry["question_id"], entry["answer_id"]) != entry["answer_id"]
+        ),
+        "cpu_ms": round(sum(turn_cpu), 2),
+        "wall_ms": round(sum(turn_wall), 2),
+        "turn_cpu_ms": turn_cpu,
+        "turn_wall_ms": turn_wall,
+    }
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    n = len(results) or 1
+    turn_cpu = [ms for r in results for ms in r["turn_cpu_ms"]]
+    turn_wall = [ms for r in results for ms in r["turn_wall_ms"]]
+    by_prompt: Dict[str, int] = {}
+    for r in results:
+        for key, count in r["llm_calls_by_prompt"].items():
+            by_prompt[key] = by_prompt.get(key, 0) + count
+    return {
+        "sessions": len(results),
+        "complete_sessions": sum(1 for r in results if r["status"] == "complete"),
+        "diverged_sessions": sum(1 for r in results if r["status"].startswith("diverged")),
+        "turns": len(turn_cpu),
+        "llm_calls_per_session": round(sum(r["llm_calls"] for r in results) / n, 3),
+        "tokens_per_session": round(sum(r["tokens"] for r in results) / n, 1),
+        "reasks_per_session": round(sum(r["reasks"] for r in results) / n, 3),
+        "answer_mismatches": sum(r["answer_mismatches"] for r in results),
+        "turn_cpu_ms_p50": round(percentile(turn_cpu, 50), 3),
+        "turn_cpu_ms_p95": round(percentile(turn_cpu, 95), 3),
+        "turn_wall_ms_p50": round(percentile(turn_wall, 50), 3),
+        "turn_wall_ms_p95": round(percentile(turn_wall, 95), 3),
+        "llm_calls_by_prompt": dict(sorted(by_prompt.items())),
+    }
+
+
+def compare(summary: Dict[str, Any], results: List[Dict[str, Any]], baseline: Dict[str, Any],
+            tolerances: Dict[str, float]) -> bool:
+    """Print current vs baseline; return True if any metric regressed beyond its tolerance."""
+    regressed = False
+    print(f"\n{'metric':<24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, kind in COMPARED:
+        old, new = baseline["summary"].get(name, 0), summary[name]
+        change = (new - old) / old if old else (1.0 if new > old else 0.0)
+        worse = change > tolerances[kind] and new > old
+        regressed = regressed or worse
+        print(f"{name:<24}{old:>12}{new:>12}{change:>+10.1%}{'  REGRESSION' if worse else ''}")
+
+    old_sessions = {r["session"]: r for r in baseline.get("sessions", [])}
+    more_calls = [
+        (r["llm_calls"] - old_sessions[r["session"]]["llm_calls"], r)
+        for r in results if r["session"] in old_sessions and r["llm_calls"] > old_sessions[r["session"]]["llm_calls"]
+    ]
+    if more_calls:
+        print(f"\n{len(more_calls)} sessions make more LLM calls than in the baseline, e.g.:")
+        for extra, r in sorted(more_calls, key=lambda item: -item[0])[:10]:
+            old = old_sessions[r["session"]]["llm_calls_by_prompt"]
+            changed = {k: f"{old.get(k, 0)}->{v}" for k, v in r["llm_calls_by_prompt"].items() if old.get(k, 0) != v}
+            print(f"  {r['session']}: +{extra} {changed}")
+    return regressed
+
+
+async def main(args) -> int:
+    transcripts = load_transcripts(args.transcripts, args.limit)
+    if not transcripts:
+        print(f"No transcripts with a first message under {args.transcripts}")
+        return 1
+    workdir = tempfile.mkdtemp(prefix="ars-replay-")
+    results = []
+    try:
+        isolate(workdir)
+        started = time.perf_counter()
+        # The engine prints and logs every turn; keep that out of the timings and the report.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for transcript in transcripts:
+                results.append(await replay_session(transcript, args.max_turns))
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(results)
+    print(f"replayed {summary['sessions']} sessions, {summary['turns']} turns in {elapsed:.1f}s "
+          f"({summary['complete_sessions']} complete, {summary['diverged_sessions']} diverged)")
+    for key in ("llm_calls_per_session", "tokens_per_session", "reasks_per_session", "answer_mismatches",
+                "turn_cpu_ms_p50", "turn_cpu_ms_p95", "turn_wall_ms_p50", "turn_wall_ms_p95"):
+        print(f"  {key}: {summary[key]}")
+    for key, count in summary["llm_calls_by_prompt"].items():
+        print(f"  llm {key}: {count}")
+
+    stored_sessions = [{k: v for k, v in r.items() if not k.startswith("turn_")} for r in results]
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "sessions": stored_sessions}, f, ensure_ascii=False, indent=1)
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(summary, results, baseline, {"count": args.count_tolerance, "time": args.time_tolerance}):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay stored transcripts in process and diff against a baseline")
+    parser.add_argument("--transcripts", default=ep.CHAT_HISTORY_DIR)
+    parser.add_argument("--limit", type=int, default=None, help="replay at most this many sessions")
+    parser.add_argument("--max-turns", type=int, default=200)
+    parser.add_argument("--baseline", help="compare against this baseline file")
+    parser.add_argument("--save-baseline", help="write this run's results as a baseline")
+    parser.add_argument("--count-tolerance", type=float, default=0.0,
+                        help="allowed relative increase of calls, tokens, re-asks and divergences")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="allowed relative increase of turn times")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,111 @@
+import re
+import logging
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Spelled-out Finnish numbers accepted on the 1-10 pain scale.
+FINNISH_NUMERALS = {
+    "yksi": 1, "yks": 1,
+    "kaksi": 2, "kaks": 2,
+    "kolme": 3,
+    "neljä": 4, "nelja": 4,
+    "viisi": 5, "viis": 5,
+    "kuusi": 6, "kuus": 6,
+    "seitsemän": 7, "seitseman": 7, "seittemän": 7, "seiska": 7,
+    "kahdeksan": 8, "kasi": 8,
+    "yhdeksän": 9, "yhdeksan": 9, "ysi": 9,
+    "kymmenen": 10, "kymppi": 10,
+}
+
+# Canonical option text -> answers that mean exactly that option.
+SYNONYMS = {
+    "kyllä": {"kyllä", "kylla", "kyl", "joo", "juu", "jep", "on", "kyllä on", "joo on", "on kyllä", "yes"},
+    "ei": {"ei", "ei ole", "ei oo", "eipä", "eipä ole", "en", "ei ei"},
+    "en osaa sanoa": {"en osaa sanoa", "en tiedä", "en tieda", "en tiiä", "en osaa", "en ole varma"},
+}
+
+SCALE_PATTERN = re.compile(r"^(?:vas\s*)?(\d{1,2})(?:\s*/\s*10)?$")
+
+# Many tree texts were saved with ä/ö/å replaced by U+FFFD ("Kyll\ufffd"), so option
+# texts are compared with all of these folded to one character.
+MOJIBAKE_FOLD = str.maketrans({"ä": "\ufffd", "ö": "\ufffd", "å": "\ufffd"})
+
+
+def normalize_answer(text: str) -> str:
+    """Lowercase, drop surrounding punctuation and collapse whitespace."""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = re.sub(r"[.,!?;:\"'()]+", " ", text)
+    return " ".join(text.split())
+
+
+def _fold(normalized: str) -> str:
+    return normalized.translate(MOJIBAKE_FOLD)
+
+
+def _record(question_id: str, user_answer: str, answer_id: Optional[str]) -> Optional[str]:
+    metrics.LOCAL_MATCHES.labels("hit" if answer_id is not None else "miss").inc()
+    if answer_id is not None:
+        logger.debug(f"Local match hit for question {question_id}: '{user_answer}' -> {answer_id}")
+    else:
+        logger.debug(f"Local match miss for question {question_id}: '{user_answer}', falling back to LLM")
+    return answer_id
+
+
+def match_scale(question_id: str, user_answer: str) -> Optional[str]:
+    """Map a pain-scale answer such as "7", "7/10" or "seitsemän" to "1".."10".
+
+    Returns None when the answer is not a single unambiguous value in range.
+    """
+    normalized = normalize_answer(user_answer)
+    value = None
+    match = SCALE_PATTERN.match(normalized)
+    if match:
+        value = int(match.group(1))
+    elif normalized in FINNISH_NUMERALS:
+        value = FINNISH_NUMERALS[normalized]
+    answer_id = str(value) if value is not None and 1 <= value <= 10 else None
+    return _record(question_id, user_answer, answer_id)
+
+
+def match_choice(question_id: str, options: List[Tuple[str, str]], user_answer: str) -> Optional[str]:
+    """Map an answer to one of ``options`` given as (answer_id, answer_text) pairs.
+
+    Matches an echoed answer id, the normalized option text, or a yes/no/don't-know
+    synonym of an option. Returns None unless exactly one option matches.
+    """
+    normalized = normalize_answer(user_answer)
+    if not normalized:
+        return _record(question_id, user_answer, None)
+
+    by_id = {answer_id.lower(): answer_id for answer_id, _ in options}
+    if normalized in by_id:
+        return _record(question_id, user_answer, by_id[normalized])
+
+    by_text: Dict[str, List[str]] = {}
+    for answer_id, text in options:
+        by_text.setdefault(_fold(normalize_answer(text)), []).append(answer_id)
+
+    candidates = by_text.get(_fold(normalized), [])
+    if not candidates:
+        for canonical, synonyms in SYNONYMS.items():
+            if normalized in synonyms:
+                candidates = by_text.get(_fold(canonical), [])
+                break
+    answer_id = candidates[0] if len(candidates) == 1 else None
+    return _record(question_id, user_answer, answer_id)
+
+
+def match_ordinal(question_id: str, options: List[Tuple[str, str]], user_answer: str) -> Optional[str]:
+    """Map "2", "2." or "kaksi" to the second of ``options`` when they were shown as numbered choices."""
+    normalized = normalize_answer(user_answer)
+    if normalized.isdigit():
+        value = int(normalized)
+    else:
+        value = FINNISH_NUMERALS.get(normalized)
+    if value is None or not 1 <= value <= len(options):
+        return None
+    return _record(question_id, user_answer, options[value - 1][0])
@@ -0,0 +1,73 @@
+from typing import Any, Dict, List, Optional
+
+# Rough size estimate; good enough to keep prompts inside a budget without a tokenizer.
+CHARS_PER_TOKEN = 4
+# Longest single fact kept, in characters; the patient's opening story can be long.
+MAX_FACT_CHARS = 600
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def entry_fact(entry: Dict[str, Any]) -> Optional[str]:
+    """Compact one-line form of a chatHistory entry, or None if it carries no answer."""
+    if entry.get("re_ask") or entry["question_id"] == "summary":
+        return None
+    if entry["question_id"] == "initial_question":
+        fact = f"Patient's own description: {entry['user_answer']}"
+    elif entry.get("skipped"):
+        fact = f"{entry['question_text']} → (no answer)"
+    else:
+        answer = entry.get("chosen_answer") or entry.get("user_answer")
+        if not answer:
+            return None
+        fact = f"{entry['question_text']} → {answer}"
+    return fact[:MAX_FACT_CHARS]
+
+
+def turn_messages(entries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    message_history = []
+    for entry in entries:
+        message_history.append({
+            "role": "assistant",
+            "content": f"{entry['question_text']}"
+        })
+        message_history.append({
+            "role": "user",
+            "content": f"{entry['user_answer']}"
+        })
+    return message_history
+
+
+def build_context(entries: List[Dict[str, Any]], keep_recent: int,
+                  facts_template: str, token_budget: int) -> List[Dict[str, str]]:
+    """Bounded conversation context: earlier entries as one facts message, then the last ``keep_recent`` verbatim.
+
+    The facts are derived from the entries on every call rather than stored
+    with the session, so saving a session never rewrites them. The recent
+    turns are always kept. Facts fill what is left of ``token_budget``,
+    newest first. The first fact (the patient's own description) is always
+    kept because later questions are most often answered there.
+    """
+    folded = max(len(entries) - keep_recent, 0)
+    facts = [fact for fact in map(entry_fact, entries[:folded]) if fact]
+    recent = turn_messages(entries[folded:])
+    remaining = token_budget - sum(estimate_tokens(m["content"]) for m in recent)
+    if not facts:
+        return recent
+
+    kept = [facts[0]]
+    remaining -= estimate_tokens(facts[0])
+    newest = []
+    for fact in reversed(facts[1:]):
+        cost = estimate_tokens(fact)
+        if cost > remaining:
+            break
+        newest.append(fact)
+        remaining -= cost
+    if len(newest) < len(facts) - 1:
+        kept.append(f"... ({len(facts) - 1 - len(newest)} earlier answers omitted)")
+    kept.extend(reversed(newest))
+    facts_message = {"role": "system", "content": facts_template.format(facts="\n".join(f"- {fact}" for fact in kept))}
+    return [facts_message, *recent]
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from utils import metrics, tracing
+from utils.llm_cassette import Cassette
+
+logger = logging.getLogger(__name__)
+
+MODEL = "gpt-4.1-2025-04-14"
+
+# One pooled keep-alive client per worker process; every completion goes through it.
+MAX_CONNECTIONS = int(os.environ.get("ARS_LLM_MAX_CONNECTIONS", "500"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("ARS_LLM_MAX_KEEPALIVE", "100"))
+KEEPALIVE_EXPIRY = 30.0
+REQUEST_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Latency budget per prompt, in seconds, covering SDK retries and hedging.
+PROMPT_TIMEOUTS = {
+    "map_answer": 8.0,
+    "select_tree": 8.0,
+    "infer_answer": 15.0,
+    "lookahead_answers": 20.0,
+    "update_summary": 30.0,
+}
+DEFAULT_TIMEOUT = 30.0
+# Send a second identical request once the first is slower than this percentile of recent calls (0 disables).
+HEDGE_PERCENTILE = float(os.environ.get("ARS_LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+# Consecutive upstream failures that open the circuit, and how long it stays open.
+BREAKER_FAILURES = int(os.environ.get("ARS_LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_AFTER = float(os.environ.get("ARS_LLM_BREAKER_RESET_AFTER", "30"))
+
+# Record every completion to a cassette, or replay from it without network ("off", "record", "replay").
+# Speculative inference and summary drafts race the next turn, so zero-latency replays
+# only follow the recording exactly with ARS_SPECULATIVE_INFERENCE=0 and ARS_SUMMARY_DRAFTS=0.
+CASSETTE_MODE = os.environ.get("ARS_LLM_CASSETTE", "off")
+CASSETTE_PATH = os.environ.get("ARS_LLM_CASSETTE_PATH", "./data/llm_cassette.sqlite")
+CASSETTE_LATENCY = os.environ.get("ARS_LLM_CASSETTE_LATENCY", "recorded")  # "recorded" or "zero"
+
+# Errors that mean the upstream is slow or unhealthy, as opposed to a bad request.
+UPSTREAM_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_client: Optional[AsyncOpenAI] = None
+cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE) if CASSETTE_MODE != "off" else None
+
+
+class LLMUnavailable(Exception):
+    """The upstream timed out, failed, or the circuit breaker is open. Callers should degrade locally."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker, one per worker process.
+
+    After ``failure_threshold`` upstream failures in a row the circuit opens and
+    calls fail fast. After ``reset_after`` seconds one trial call is let
+    through (half-open); its success closes the circuit, its failure re-opens it.
+
+    Methods:
+        allow(): Whether a call may go upstream now.
+        record_success(): Close the circuit.
+        record_failure(): Count a failure, opening the circuit at the threshold.
+    """
+    def __init__(self, failure_threshold: int, reset_after: float):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self.trial_in_flight and time.monotonic() - self.opened_at >= self.reset_after:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("LLM circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"LLM circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_AFTER)
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def available() -> bool:
+    """False while the circuit is open; lets callers skip the LLM before even trying."""
+    return not breaker.is_open or time.monotonic() - breaker.opened_at >= breaker.reset_after
+
+
+def _hedge_delay(name: str) -> Optional[float]:
+    samples = _latencies.get(name)
+    if HEDGE_PERCENTILE <= 0 or not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))]
+
+
+async def _hedged(name: str, make_request: Callable[[], Awaitable[Any]]) -> Any:
+    """Await ``make_request()``; if it outlives the hedge delay, race it against a second copy."""
+    first = asyncio.ensure_future(make_request())
+    delay = _hedge_delay(name)
+    if delay is None:
+        return await first
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.info(f"Hedging {name} after {delay:.2f}s")
+            metrics.LLM_HEDGES.labels(name).inc()
+            tracing.annotate("llm.hedged_after", delay)
+            tasks.add(asyncio.ensure_future(make_request()))
+        while True:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is None or not tasks:
+                    return task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _call(name: str, make_request: Callable[[], Awaitable[Any]]) -> Any:
+    if not breaker.allow():
+        metrics.LLM_REQUESTS.labels(name, "unavailable").inc()
+        raise LLMUnavailable(f"{name}: circuit open")
+    started = time.monotonic()
+    try:
+        with tracing.span(f"llm.{name}", model=MODEL) as current:
+            result = await asyncio.wait_for(_hedged(name, make_request), PROMPT_TIMEOUTS.get(name, DEFAULT_TIMEOUT))
+            usage = getattr(result, "usage", None)
+            if current is not None and usage is not None:
+                current.set("llm.prompt_tokens", usage.prompt_tokens)
+                current.set("llm.completion_tokens", usage.completion_tokens)
+    except UPSTREAM_ERRORS as e:
+        breaker.record_failure()
+        metrics.LLM_REQUESTS.labels(name, "unavailable").inc()
+        raise LLMUnavailable(f"{name}: {e!r}") from e
+    except BaseException:
+        # Bad requests, cancellation and the like say nothing about upstream health.
+        breaker.trial_in_flight = False
+        metrics.LLM_REQUESTS.labels(name, "error").inc()
+        raise
+    breaker.record_success()
+    elapsed = time.monotonic() - started
+    _latencies.setdefault(name, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+    metrics.LLM_REQUESTS.labels(name, "ok").inc()
+    metrics.LLM_SECONDS.labels(name).observe(elapsed)
+    metrics.observe_llm(elapsed)
+    # Only the winning request of a hedged pair is counted.
+    metrics.record_usage(name, getattr(result, "usage", None))
+    return result
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+def _replayed(name: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Recorded entry for ``request``; a miss is reported as LLMUnavailable so the caller degrades as it would offline."""
+    entry = cassette.get(request)
+    if entry is None:
+        logger.warning(f"No cassette entry for {name}; the replay diverged from the recording")
+        metrics.LLM_REQUESTS.labels(name, "cassette_miss").inc()
+        raise LLMUnavailable(f"{name}: not in cassette")
+    metrics.LLM_REQUESTS.labels(name, "replayed").inc()
+    metrics.record_usage(name, SimpleNamespace(**entry["usage"]) if entry.get("usage") else None)
+    return entry
+
+
+async def _complete(name: str, request: Dict[str, Any]) -> str:
+    """Run one chat completion through the cassette (if any) and the resilient call path; return the content."""
+    if cassette is not None and cassette.mode == "replay":
+        with tracing.span(f"llm.{name}", model=MODEL, replayed=True):
+            entry = _replayed(name, request)
+            if CASSETTE_LATENCY == "recorded":
+                await asyncio.sleep(entry["latency"])
+        return entry["content"]
+    started = time.monotonic()
+    response = await _call(name, lambda: get_client().chat.completions.create(**request))
+    content = response.choices[0].message.content
+    if cassette is not None:
+        cassette.put(request, name, {
+            "content": content,
+            "usage": _usage_dict(response.usage),
+            "latency": round(time.monotonic() - started, 4),
+        })
+    return content
+
+
+def get_client() -> AsyncOpenAI:
+    """Return the process-wide async OpenAI client, creating it on first use.
+
+    The client is created lazily so each uvicorn worker builds its own pool
+    after forking, bound to that worker's event loop.
+    """
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=REQUEST_TIMEOUT,
+        )
+        _client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=http_client)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the pooled client. Called from the app lifespan on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def json_schema_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{name}_response",
+            "schema": schema,
+            "strict": True
+        }
+    }
+
+
+async def complete_json(
+    name: str,
+    messages: List[Dict[str, str]],
+    schema: Dict[str, Any],
+    max_tokens: int,
+    temperature: float = 0.0,
+) -> Dict[str, Any]:
+    """Run a structured completion for prompt ``name`` and return the parsed JSON.
+
+    Errors are propagated; callers decide how to degrade. LLMUnavailable
+    means the upstream is unhealthy rather than the request being wrong.
+    """
+    content = await _complete(name, dict(
+        model=MODEL,
+        messages=messages,
+        response_format=json_schema_format(name, schema),
+        temperature=temperature,
+        max_tokens=max_tokens
+    ))
+    return json.loads(content)
+
+
+async def complete_text(
+    name: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float = 0.0,
+) -> str:
+    """Run a free-text completion for prompt ``name`` and return the message content."""
+    return await _complete(name, dict(
+        model=MODEL,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    ))
+
+
+async def stream_text(
+    name: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float = 0.0,
+) -> AsyncIterator[str]:
+    """Stream a free-text completion for prompt ``name``, yielding content deltas as they arrive.
+
+    The latency budget applies to the start of the stream and to every gap between chunks; streams are not hedged.
+    """
+    request = dict(
+        model=MODEL,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    if cassette is not None and cassette.mode == "replay":
+        with tracing.span(f"llm.{name}.first_chunk", model=MODEL, stream=True, replayed=True):
+            entry = _replayed(name, request)
+            if CASSETTE_LATENCY == "recorded":
+                await asyncio.sleep(entry["first_chunk"])
+        gap = (entry["latency"] - entry["first_chunk"]) / max(1, len(entry["chunks"]))
+        for delta in entry["chunks"]:
+            yield delta
+            if CASSETTE_LATENCY == "recorded":
+                await asyncio.sleep(gap)
+        return
+    if not breaker.allow():
+        metrics.LLM_REQUESTS.labels(name, "unavailable").inc()
+        raise LLMUnavailable(f"{name}: circuit open")
+    timeout = PROMPT_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+    started = time.monotonic()
+    recorded: List[str] = []
+    first_chunk = usage = stream = None
+    try:
+        with tracing.span(f"llm.{name}.first_chunk", model=MODEL, stream=True):
+            stream = await asyncio.wait_for(get_client().chat.completions.create(**request), timeout)
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_chunk is None:
+                    first_chunk = time.monotonic() - started
+                recorded.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            # With include_usage the last chunk has no choices, only usage.
+            usage = getattr(chunk, "usage", None) or usage
+            metrics.record_usage(name, getattr(chunk, "usage", None))
+    except UPSTREAM_ERRORS as e:
+        breaker.record_failure()
+        metrics.LLM_REQUESTS.labels(name, "unavailable").inc()
+        raise LLMUnavailable(f"{name}: {e!r}") from e
+    except (GeneratorExit, asyncio.CancelledError):
+        # The consumer stopped reading (client disconnect, aclose()). That says nothing about
+        # upstream health: free a half-open trial slot but record neither success nor failure.
+        breaker.trial_in_flight = False
+        metrics.LLM_REQUESTS.labels(name, "cancelled").inc()
+        if stream is not None:
+            await stream.close()
+        raise
+    except BaseException:
+        breaker.trial_in_flight = False
+        metrics.LLM_REQUESTS.labels(name, "error").inc()
+        raise
+    breaker.record_success()
+    elapsed = time.monotonic() - started
+    metrics.LLM_REQUESTS.labels(name, "ok").inc()
+    metrics.LLM_SECONDS.labels(name).observe(elapsed)
+    metrics.observe_llm(elapsed)
+    if cassette is not None:
+        cassette.put(request, name, {
+            "content": "".join(recorded),
+            "chunks": recorded,
+            "usage": _usage_dict(usage),
+            "first_chunk": round(first_chunk if first_chunk is not None else elapsed, 4),
+            "latency": round(elapsed, 4),
+        })
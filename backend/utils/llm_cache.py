@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Only refresh the LRU timestamp of a hot entry this often, to keep hits read-mostly.
+TOUCH_INTERVAL = 60.0
+# Run eviction once per this many inserts.
+EVICT_EVERY = 256
+
+
+class LLMCache:
+    """
+    Persistent cache of deterministic (temperature 0) LLM results.
+
+    Backed by a single SQLite file in WAL mode so every uvicorn worker on the
+    host shares it. Entries expire after ``ttl`` seconds and the least recently
+    used ones are evicted once the table grows past ``max_entries``. Keys mix in
+    ``version`` (the prompts.json hash) so editing a prompt invalidates its
+    cached answers. Callers run ``get``/``set`` in worker threads, so the shared
+    connection is only used under ``_lock``.
+
+    Methods:
+        make_key(prompt_name, *parts): Build a cache key.
+        get(key): Return (hit, value); value may legitimately be None.
+        set(key, value): Store a JSON-serializable value.
+    """
+    def __init__(self, path: str, version: str, ttl: float, max_entries: int):
+        self.path = path
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def make_key(self, prompt_name: str, *parts: str) -> str:
+        raw = "\x1f".join([self.version, prompt_name, *parts])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Tuple[bool, Any]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at, accessed_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.misses += 1
+                return False, None
+            if now - row[2] > TOUCH_INTERVAL:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return True, json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache read failed: {e}")
+            return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: str, value: Any) -> None:
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._inserts += 1
+            if self._inserts % EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache write failed: {e}")
+
+    def evict(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+            )
+            logger.info(f"Evicted {overflow} least recently used LLM cache entries")
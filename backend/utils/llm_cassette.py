@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay")
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Hash of the request arguments with keys sorted, so equal requests match across runs and workers."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded LLM request/response pairs for deterministic benchmark runs.
+
+    In "record" mode every successful completion is stored under the hash of
+    its request arguments (model, messages, response format, temperature,
+    max_tokens, stream), numbered in order when the same request is made
+    again. In "replay" mode the same requests are answered from the file
+    without touching the network: the n-th repeat of a request in this process
+    gets the n-th recording, and the last one once they run out. Sequences are
+    counted per process, so repeats only replay exactly with a single worker.
+    Responses are stored as zlib-compressed JSON in one SQLite file (WAL),
+    shared by all workers like the LLM cache.
+
+    Methods:
+        get(request): Return the next recorded entry for a request, or None.
+        put(request, prompt_name, entry): Record an entry as the next occurrence of the request.
+    """
+    def __init__(self, path: str, mode: str):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self._conn: Optional[sqlite3.Connection] = None
+        self._replayed: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cassette ("
+                "key TEXT NOT NULL, seq INTEGER NOT NULL, prompt TEXT NOT NULL, value BLOB NOT NULL, "
+                "recorded_at REAL NOT NULL, PRIMARY KEY (key, seq))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = request_key(request)
+        seq = self._replayed.get(key, 0)
+        try:
+            row = self._connect().execute(
+                "SELECT value FROM cassette WHERE key = ? AND seq <= ? ORDER BY seq DESC LIMIT 1", (key, seq)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Cassette read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self._replayed[key] = seq + 1
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, request: Dict[str, Any], prompt_name: str, entry: Dict[str, Any]) -> None:
+        value = zlib.compress(json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        key = request_key(request)
+        try:
+            # One statement, so concurrent workers cannot take the same seq.
+            self._connect().execute(
+                "INSERT INTO cassette (key, seq, prompt, value, recorded_at) "
+                "SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ? FROM cassette WHERE key = ?",
+                (key, prompt_name, value, time.time(), key)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Cassette write failed: {e}")
@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import contextlib
+import contextvars
+from typing import Any, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# With PROMETHEUS_MULTIPROC_DIR set (see devops/cloud-init), every uvicorn worker
+# writes its samples to files there and /metrics sums them across workers.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+TURN_SECONDS = Histogram("ars_turn_seconds", "Wall time of one answer turn", ["endpoint"], buckets=PHASE_BUCKETS)
+PHASE_SECONDS = Histogram(
+    "ars_turn_phase_seconds", "Time spent per phase (session_load, tree_lookup, llm, llm_background, save)", ["phase"],
+    buckets=PHASE_BUCKETS
+)
+LLM_SECONDS = Histogram("ars_llm_request_seconds", "Latency of successful LLM calls", ["prompt"], buckets=LLM_BUCKETS)
+LLM_REQUESTS = Counter("ars_llm_requests_total", "LLM calls by outcome (ok, error, unavailable, cancelled, replayed, cassette_miss)", ["prompt", "outcome"])
+LLM_HEDGES = Counter("ars_llm_hedged_requests_total", "Second requests sent after the hedge delay", ["prompt"])
+LLM_TOKENS = Counter("ars_llm_tokens_total", "Tokens reported by the API", ["prompt", "kind"])
+LLM_CACHE = Counter("ars_llm_cache_requests_total", "LLM cache lookups", ["prompt", "result"])
+LOCAL_MATCHES = Counter("ars_local_match_total", "Answers mapped by the local matcher", ["result"])
+REASKS = Counter("ars_reasks_total", "Questions asked again", ["tree", "reason"])
+SKIPS = Counter("ars_skips_total", "Questions skipped after too many retries", ["tree"])
+INFERRED = Counter("ars_inferred_answers_total", "Questions answered from earlier statements", ["tree", "source"])
+# Labelled by pid so per-worker values survive multiprocess aggregation.
+LOOP_STALL = Counter("ars_event_loop_stall_seconds_total", "Time the event loop was late to wake up", ["worker"])
+LOOP_LAG = Histogram("ars_event_loop_lag_seconds", "Event loop wake-up delay per probe", buckets=PHASE_BUCKETS)
+
+# Phase that LLM time is booked under; background work after the response uses its own label.
+_llm_phase: contextvars.ContextVar[str] = contextvars.ContextVar("ars_llm_phase", default="llm")
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def background() -> Iterator[None]:
+    """Book LLM calls in the block as phase "llm_background", so they stay out of the turn's "llm" phase."""
+    token = _llm_phase.set("llm_background")
+    try:
+        yield
+    finally:
+        _llm_phase.reset(token)
+
+
+def observe_llm(elapsed: float) -> None:
+    PHASE_SECONDS.labels(_llm_phase.get()).observe(elapsed)
+
+
+async def monitor_event_loop(interval: float, threshold: float) -> None:
+    """Sleep ``interval`` repeatedly and record how late each wake-up is.
+
+    Lateness above ``threshold`` means something blocked the loop (sync I/O,
+    CPU work) and counts as stall time for this worker.
+    """
+    worker = str(os.getpid())
+    stall = LOOP_STALL.labels(worker)
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        LOOP_LAG.observe(lag)
+        if lag > threshold:
+            stall.inc(lag)
+
+
+def record_usage(prompt: str, usage: Any) -> None:
+    if usage is None:
+        return
+    LLM_TOKENS.labels(prompt, "prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(prompt, "completion").inc(usage.completion_tokens or 0)
+
+
+class ActivityTracker:
+    """
+    Last-seen time per session in a SQLite file shared by all workers.
+
+    A session counts as active if it had a turn within ``window`` seconds.
+    Reported at scrape time as the ``ars_active_sessions`` gauge, which a
+    per-process gauge could not get right once sessions move between workers.
+    Turns touch it from worker threads and /metrics reads it from the threadpool,
+    so the shared connection is only used under ``_lock``.
+
+    Methods:
+        touch(session_id): Mark a session active now.
+        count(): Number of sessions active within the window.
+        collect(): Prometheus collector protocol.
+    """
+    def __init__(self, path: str, window: float):
+        self.path = path
+        self.window = window
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS activity (session_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS activity_last_seen ON activity (last_seen)")
+            self._conn = conn
+        return self._conn
+
+    def touch(self, session_id: str) -> None:
+        try:
+            with self._lock:
+                self._connect().execute(
+                    "INSERT OR REPLACE INTO activity (session_id, last_seen) VALUES (?, ?)", (session_id, time.time())
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Activity write failed: {e}")
+
+    def count(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            cutoff = time.time() - self.window
+            conn.execute("DELETE FROM activity WHERE last_seen < ?", (cutoff,))
+            return conn.execute("SELECT COUNT(*) FROM activity").fetchone()[0]
+
+    def collect(self):
+        try:
+            value = self.count()
+        except sqlite3.Error as e:
+            logger.error(f"Activity read failed: {e}")
+            return
+        yield GaugeMetricFamily(
+            "ars_active_sessions", f"Sessions with a turn in the last {int(self.window)} seconds", value=value
+        )
+
+
+def render(activity: ActivityTracker) -> bytes:
+    """Exposition text for /metrics, summed over all workers in multiprocess mode."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    extra = CollectorRegistry()
+    extra.register(activity)
+    return generate_latest(registry) + generate_latest(extra)
@@ -0,0 +1,71 @@
+import copy
+import hashlib
+from typing import Any, Dict, List, Tuple
+
+from utils.question_nodes import QuestionNode
+
+# The ligert processor maps answers onto this fixed pain scale; "-1" means "unclear, ask again".
+LIGERT_SCALE = {
+    "1": "Erittäin lievä kipu",
+    "2": "Hyvin lievä kipu",
+    "3": "Lievä kipu",
+    "4": "Epämiellyttävä kipu",
+    "5": "Kohtalainen kipu",
+    "6": "Häiritsevä kipu",
+    "7": "Kova kipu",
+    "8": "Erittäin kova kipu",
+    "9": "Sietämätön kipu",
+    "10": "Erittäin sietämätön kipu",
+    "-1": "käyttäjä ei vastannut selkeästi / yhden kirjaimen vastaus",
+}
+
+
+class PromptPlan:
+    """
+    Everything the map_answer call needs for one question, built on first use and cached on the tree.
+
+    Attributes:
+        question_id (str): The question this plan belongs to.
+        choices (List[Tuple[str, str]]): (answer_id, answer_text) pairs, in tree order.
+        answer_texts (Dict[str, str]): Answer text by answer id.
+        answer_children (Dict[str, Tuple[str, ...]]): Follow-up question ids by answer id.
+        options_str (str): Options as rendered into the prompt.
+        context_message (str): Static per-question prompt message (question and options).
+        context_digest (str): Hash of ``context_message``, used in cache keys.
+        schema (Dict[str, Any]): map_answer schema whose answer_id is an enum of valid ids or null.
+    """
+    __slots__ = (
+        "question_id", "choices", "answer_texts", "answer_children",
+        "options_str", "context_message", "context_digest", "schema",
+    )
+
+    def __init__(self, question_id: str, choices: List[Tuple[str, str]], answer_children: Dict[str, Tuple[str, ...]],
+                 question_text: str, map_prompt: Dict[str, Any]):
+        self.question_id = question_id
+        self.choices = choices
+        self.answer_texts = dict(choices)
+        self.answer_children = answer_children
+        self.options_str = ", ".join(f"{text}: {answer_id}" for answer_id, text in choices)
+        self.context_message = map_prompt["context"].format(question_text=question_text, options=self.options_str)
+        self.context_digest = hashlib.sha256(self.context_message.encode("utf-8")).hexdigest()
+        self.schema = copy.deepcopy(map_prompt["response_schema"])
+        answer_id_schema = self.schema["properties"]["answer_id"]
+        self.schema["properties"]["answer_id"] = {
+            "anyOf": [
+                {"type": "string", "enum": [answer_id for answer_id, _ in choices]},
+                {"type": "null"},
+            ],
+            "description": answer_id_schema.get("description", ""),
+        }
+
+
+def build_prompt_plan(question: QuestionNode, map_prompt: Dict[str, Any]) -> PromptPlan:
+    if question.type == "ligert":
+        return PromptPlan(question.question_id, list(LIGERT_SCALE.items()), {}, question.text, map_prompt)
+    return PromptPlan(
+        question.question_id,
+        [(answer.answer_id, answer.text) for answer in question.answers],
+        {answer.answer_id: answer.child_ids for answer in question.answers},
+        question.text,
+        map_prompt,
+    )
@@ -0,0 +1,85 @@
+import sys
+from typing import Any, Dict, List, Tuple
+
+
+class AnswerNode:
+    """
+    One answer option of a question.
+
+    Attributes:
+        answer_id (str): Answer id, e.g. "2_3".
+        text (str): Finnish answer text ("" for non-choice questions).
+        print_text (str): Finnish print template; "__" is replaced by the user's answer.
+        child_ids (Tuple[str, ...]): Ids of the follow-up questions this answer opens, in order.
+    """
+    __slots__ = ("answer_id", "text", "print_text", "child_ids")
+
+    def __init__(self, answer_id: str, text: str, print_text: str, child_ids: Tuple[str, ...]):
+        self.answer_id = answer_id
+        self.text = text
+        self.print_text = print_text
+        self.child_ids = child_ids
+
+    def __repr__(self):
+        return f"AnswerNode({self.answer_id!r}, {self.text!r}, children={list(self.child_ids)})"
+
+
+class QuestionNode:
+    """
+    One question of a tree, with its answers flattened to child id lists.
+
+    Attributes:
+        question_id (str): Question id, unique within its tree.
+        type (str): Question type ("valinta", "ligert", ...).
+        text (str): Finnish question text.
+        answers (Tuple[AnswerNode, ...]): Answer options in tree order.
+    """
+    __slots__ = ("question_id", "type", "text", "answers")
+
+    def __init__(self, question_id: str, type: str, text: str, answers: Tuple[AnswerNode, ...]):
+        self.question_id = question_id
+        self.type = type
+        self.text = text
+        self.answers = answers
+
+    def __repr__(self):
+        return f"QuestionNode({self.question_id!r}, {self.type!r}, {self.text!r})"
+
+
+def _fi(text: Any) -> str:
+    # Non-choice answers store answerText as "" instead of {"FI": ...}.
+    return text.get("FI", "") if isinstance(text, dict) else (text or "")
+
+
+def build_node_table(file_contents: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, QuestionNode]]:
+    """Flatten a nested question tree into (root ids, {questionId: QuestionNode}).
+
+    Walks the tree once in pre-order with an explicit stack. When a questionId
+    is defined more than once the first definition wins and the later one is
+    skipped together with its follow-ups, as in excel/compile_trees.py, so the
+    JSON and compiled paths build the same table. None of the nested source
+    dicts are kept alive.
+    """
+    root_ids = [sys.intern(q["questionId"]) for q in file_contents]
+    nodes: Dict[str, QuestionNode] = {}
+    stack = list(reversed(file_contents))
+    while stack:
+        raw = stack.pop()
+        question_id = sys.intern(raw["questionId"])
+        if question_id in nodes:
+            continue
+        answers = []
+        for raw_answer in raw.get("answers") or []:
+            children = raw_answer.get("question") or []
+            answers.append(AnswerNode(
+                sys.intern(raw_answer["answerId"]),
+                _fi(raw_answer.get("answerText")),
+                _fi(raw_answer.get("printText")),
+                tuple(sys.intern(child["questionId"]) for child in children),
+            ))
+        for raw_answer in reversed(raw.get("answers") or []):
+            stack.extend(reversed(raw_answer.get("question") or []))
+        nodes[question_id] = QuestionNode(
+            question_id, sys.intern(raw["type"]), _fi(raw.get("questionText")), tuple(answers)
+        )
+    return root_ids, nodes
@@ -0,0 +1,123 @@
+import os
+import time
+import fcntl
+import asyncio
+import hashlib
+import contextlib
+from typing import AsyncIterator, Dict, List, Optional
+
+from utils import tracing
+
+POLL_INITIAL = 0.005
+POLL_MAX = 0.05
+
+
+async def acquire_within(lock: asyncio.Lock, timeout: float) -> bool:
+    """Acquire ``lock`` within ``timeout`` seconds; False if it timed out.
+
+    Unlike ``asyncio.wait_for(lock.acquire(), timeout)``, a timeout or
+    cancellation that races with the acquire never leaves the lock held.
+    """
+    acquire = asyncio.ensure_future(lock.acquire())
+    try:
+        await asyncio.wait({acquire}, timeout=timeout)
+    except BaseException:
+        if acquire.done() and not acquire.cancelled():
+            lock.release()
+        else:
+            acquire.cancel()
+        raise
+    if acquire.done():
+        return True
+    acquire.cancel()
+    return False
+
+
+class SessionLocks:
+    """
+    Per-session mutual exclusion across uvicorn worker processes.
+
+    Each session has its own lock file under ``root``, held with ``flock``
+    and removed again by the holder on release, so only sessions with a
+    turn in flight have a file. Within a worker, waiters queue on an
+    asyncio.Lock per session first, so only one coroutine per process polls
+    the file lock and the event loop is never blocked.
+
+    Methods:
+        hold(session_id, timeout): Async context manager; raises TimeoutError if not acquired in time.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # Session key -> [lock, number of holders and waiters]; dropped when the count reaches zero.
+        self._local: Dict[str, List] = {}
+
+    def _key(self, session_id: str) -> str:
+        # Session ids come from clients, so they are hashed rather than used as file names.
+        return hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, session_id: str, timeout: float) -> AsyncIterator[None]:
+        key = self._key(session_id)
+        deadline = time.monotonic() + timeout
+        entry = self._local.get(key)
+        if entry is None:
+            entry = self._local[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            with tracing.span("session_lock.wait_local"):
+                acquired = await acquire_within(entry[0], timeout)
+            if not acquired:
+                raise TimeoutError(f"Session {session_id} is busy")
+            try:
+                with tracing.span("session_lock.wait_file"):
+                    fd = await self._lock_file(key, deadline)
+                if fd is None:
+                    raise TimeoutError(f"Session {session_id} is busy in another worker")
+                try:
+                    yield
+                finally:
+                    self._unlock_file(key, fd)
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._local.get(key) is entry:
+                del self._local[key]
+
+    async def _lock_file(self, key: str, deadline: float) -> Optional[int]:
+        path = os.path.join(self.root, f"{key}.lock")
+        delay = POLL_INITIAL
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            os.close(fd)
+                            return None
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, POLL_MAX)
+                # The previous holder may have removed the file while we waited; then lock the new one.
+                try:
+                    if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                        return fd
+                except FileNotFoundError:
+                    pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _unlock_file(self, key: str, fd: int) -> None:
+        try:
+            # Removed while still locked, so a waiter on this file sees it is stale and retries.
+            os.unlink(os.path.join(self.root, f"{key}.lock"))
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
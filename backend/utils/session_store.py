@@ -0,0 +1,401 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rewrite a journaled session's state file into a single snapshot line after this many saves.
+JOURNAL_COMPACT_EVERY = 16
+# Session list fields that only ever grow, with the journal file suffix each is appended to.
+APPEND_ONLY_FIELDS = {"chatHistory": "turns", "summary_parts": "summary"}
+
+
+class SessionStore:
+    """
+    Persistence interface for chat sessions.
+
+    Sessions are plain dicts (``ChatHistory.model_dump()``). The list fields in
+    ``APPEND_ONLY_FIELDS`` (``chatHistory`` and ``summary_parts``) are treated
+    as append-only: backends may persist only the items added since the last
+    save. ``save`` may be called from worker threads
+    (the endpoint runs it via ``asyncio.to_thread``), so backends must be safe
+    to use from several threads at once.
+
+    Methods:
+        load(session_id): Return the stored session dict or None.
+        save(session_id, data): Persist the session and return its new revision.
+        revision(session_id): Cheap token that changes whenever the session is saved.
+    """
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> Optional[str]:
+        raise NotImplementedError
+
+    def revision(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+def _atomic_write(path: str, payload: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class ShardedFileSessionStore(SessionStore):
+    """
+    One JSON file per session under ``root/xx/yy/`` (hash-sharded directories).
+
+    Writes go to a temp file in the same directory and are renamed into place,
+    so readers never see a half-written session. Sessions written by the old
+    flat layout (``root/{session_id}.json``) are still readable.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, session_id: str) -> str:
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{session_id}.json")
+
+    def _existing_path(self, session_id: str) -> Optional[str]:
+        path = self._path(session_id)
+        if os.path.exists(path):
+            return path
+        legacy_path = os.path.join(self.root, f"{session_id}.json")
+        if os.path.exists(legacy_path):
+            return legacy_path
+        return None
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        path = self._existing_path(session_id)
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> Optional[str]:
+        path = self._path(session_id)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        _atomic_write(path, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        return self.revision(session_id)
+
+    def revision(self, session_id: str) -> Optional[str]:
+        path = self._existing_path(session_id)
+        if path is None:
+            return None
+        st = os.stat(path)
+        return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+class JournalSessionStore(ShardedFileSessionStore):
+    """
+    Append-only journals of turns and summary parts plus a small, periodically compacted state file.
+
+    Each session lives next to where the sharded file store would put it:
+
+        {session_id}.turns.jsonl    one chatHistory entry per line, only ever appended
+        {session_id}.summary.jsonl  one summary_parts item per line, only ever appended
+        {session_id}.state.jsonl    one line per save with stack, current question and
+                                    the other scalar fields, plus how many items (and
+                                    bytes of each journal) that save committed
+
+    A save appends the new items and then one state line, so per-turn write
+    cost no longer grows with the length of the conversation. The state line is
+    the commit point: a journal tail beyond the last committed byte offset
+    belongs to an interrupted save and is truncated away on the next append.
+    Once the state file holds ``JOURNAL_COMPACT_EVERY`` lines it is atomically
+    replaced by a one-line snapshot. Loading replays the last state line plus
+    the committed items. Sessions still in the single-file layout are read as
+    before and migrated on their next save.
+    """
+    def _journal_path(self, session_id: str, suffix: str) -> str:
+        return f"{self._path(session_id)[:-len('.json')]}.{suffix}.jsonl"
+
+    def _journal_paths(self, session_id: str) -> Tuple[str, str]:
+        return self._journal_path(session_id, "state"), self._journal_path(session_id, "turns")
+
+    @staticmethod
+    def _read_state(state_path: str) -> Tuple[Optional[Dict[str, Any]], int, int]:
+        """Return (last committed state, byte offset after it, number of committed lines)."""
+        try:
+            with open(state_path, "rb") as file:
+                raw = file.read()
+        except FileNotFoundError:
+            return None, 0, 0
+        lines: List[bytes] = raw.split(b"\n")
+        # Everything after the final newline is a torn write and is ignored.
+        complete = [line for line in lines[:-1] if line]
+        valid_end = raw.rfind(b"\n") + 1
+        if not complete:
+            return None, valid_end, 0
+        return json.loads(complete[-1]), valid_end, len(complete)
+
+    @staticmethod
+    def _read_items(path: str, committed: int) -> List[Any]:
+        if not committed:
+            return []
+        with open(path, "rb") as file:
+            raw = file.read(committed)
+        return [json.loads(line) for line in raw.splitlines() if line]
+
+    @staticmethod
+    def _append_items(path: str, committed: int, items: List[Any]) -> int:
+        """Write ``items`` after the first ``committed`` bytes of ``path``; return the bytes written."""
+        if not items:
+            return 0
+        payload = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+        with open(path, "a+b") as file:
+            file.truncate(committed)
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        return len(payload)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        state, _, _ = self._read_state(self._journal_path(session_id, "state"))
+        if state is None:
+            return super().load(session_id)
+        for field, suffix in APPEND_ONLY_FIELDS.items():
+            if f"_{suffix}" in state:
+                state.pop(f"_{suffix}")
+                committed = state.pop(f"_{suffix}_bytes")
+                state[field] = self._read_items(self._journal_path(session_id, suffix), committed)
+        return state
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> Optional[str]:
+        state_path = self._journal_path(session_id, "state")
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        last_state, valid_end, line_count = self._read_state(state_path)
+
+        state = {key: value for key, value in data.items() if key not in APPEND_ONLY_FIELDS}
+        for field, suffix in APPEND_ONLY_FIELDS.items():
+            if field not in data:
+                continue
+            items = data[field]
+            count = last_state.get(f"_{suffix}", 0) if last_state else 0
+            committed = last_state.get(f"_{suffix}_bytes", 0) if last_state else 0
+            if len(items) < count:
+                # The list was rewritten rather than appended to; start its journal afresh
+                # and snapshot the state, so no older state line points into the new content.
+                count, committed, line_count = 0, 0, JOURNAL_COMPACT_EVERY
+            committed += self._append_items(self._journal_path(session_id, suffix), committed, items[count:])
+            state[f"_{suffix}"] = len(items)
+            state[f"_{suffix}_bytes"] = committed
+
+        record = (json.dumps(state, ensure_ascii=False) + "\n").encode("utf-8")
+        if line_count + 1 >= JOURNAL_COMPACT_EVERY:
+            _atomic_write(state_path, record)
+        else:
+            with open(state_path, "a+b") as file:
+                file.truncate(valid_end)
+                file.write(record)
+                file.flush()
+                os.fsync(file.fileno())
+        return self.revision(session_id)
+
+    def revision(self, session_id: str) -> Optional[str]:
+        try:
+            st = os.stat(self._journal_path(session_id, "state"))
+        except FileNotFoundError:
+            return super().revision(session_id)
+        return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite (WAL mode) store with one row per session, one row per turn and one
+    row per item of the other append-only fields (``session_items``).
+
+    Saving a session only inserts the turns and items added since the previous
+    save and rewrites the small session row holding stack, current question and the
+    other scalar fields. The connection is shared by all threads, so every
+    use of it holds ``_lock``.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, turn_count INTEGER NOT NULL, "
+                "revision INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, entry TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, seq))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_items ("
+                "session_id TEXT NOT NULL, field TEXT NOT NULL, seq INTEGER NOT NULL, item TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, field, seq))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            entries = conn.execute(
+                "SELECT entry FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            items = conn.execute(
+                "SELECT field, item FROM session_items WHERE session_id = ? ORDER BY field, seq", (session_id,)
+            ).fetchall()
+        data = json.loads(row[0])
+        data["chatHistory"] = [json.loads(entry) for (entry,) in entries]
+        for field, suffix in APPEND_ONLY_FIELDS.items():
+            # The state records an item count for every other append-only field the session had.
+            if f"_{suffix}" in data:
+                del data[f"_{suffix}"]
+                data[field] = [json.loads(item) for item_field, item in items if item_field == field]
+        return data
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> Optional[str]:
+        with self._lock:
+            return self._save(self._connect(), session_id, data)
+
+    def _save(self, conn: sqlite3.Connection, session_id: str, data: Dict[str, Any]) -> str:
+        entries = data.get("chatHistory", [])
+        state = {key: value for key, value in data.items() if key not in APPEND_ONLY_FIELDS}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT turn_count, revision, state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            turn_count, revision, previous = (row[0], row[1], json.loads(row[2])) if row else (0, 0, {})
+            if len(entries) < turn_count:
+                conn.execute("DELETE FROM turns WHERE session_id = ? AND seq >= ?", (session_id, len(entries)))
+            conn.executemany(
+                "INSERT OR REPLACE INTO turns (session_id, seq, entry) VALUES (?, ?, ?)",
+                [
+                    (session_id, seq, json.dumps(entries[seq], ensure_ascii=False))
+                    for seq in range(turn_count, len(entries))
+                ]
+            )
+            for field, suffix in APPEND_ONLY_FIELDS.items():
+                if field == "chatHistory" or field not in data:
+                    continue
+                items = data[field]
+                count = previous.get(f"_{suffix}", 0)
+                if len(items) < count:
+                    conn.execute("DELETE FROM session_items WHERE session_id = ? AND field = ?", (session_id, field))
+                    count = 0
+                conn.executemany(
+                    "INSERT OR REPLACE INTO session_items (session_id, field, seq, item) VALUES (?, ?, ?, ?)",
+                    [
+                        (session_id, field, seq, json.dumps(items[seq], ensure_ascii=False))
+                        for seq in range(count, len(items))
+                    ]
+                )
+                state[f"_{suffix}"] = len(items)
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, turn_count, revision, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, json.dumps(state, ensure_ascii=False), len(entries), revision + 1, time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return str(revision + 1)
+
+    def revision(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return str(row[0]) if row else None
+
+
+class LRUSessionStore(SessionStore):
+    """
+    Bounded in-process LRU of hot sessions in front of another store.
+
+    Every load still asks the backend for the session's revision, so a turn
+    saved by another worker is never served stale; only the parse is skipped.
+    Saves run in worker threads while loads run on the event loop, so the
+    cache itself is only touched under ``_lock``.
+    """
+    def __init__(self, backend: SessionStore, max_sessions: int):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session_id: str, revision: Optional[str], data: Dict[str, Any]) -> None:
+        if revision is None or self.max_sessions <= 0:
+            return
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._cache[session_id] = (revision, data)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        revision = self.backend.revision(session_id)
+        with self._lock:
+            if revision is None:
+                self._cache.pop(session_id, None)
+                return None
+            cached = self._cache.get(session_id)
+            if cached and cached[0] == revision:
+                self._cache.move_to_end(session_id)
+            else:
+                cached = None
+        if cached:
+            return copy.deepcopy(cached[1])
+        data = self.backend.load(session_id)
+        if data is not None:
+            self._remember(session_id, revision, data)
+        return data
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> Optional[str]:
+        revision = self.backend.save(session_id, data)
+        self._remember(session_id, revision, data)
+        return revision
+
+    def revision(self, session_id: str) -> Optional[str]:
+        return self.backend.revision(session_id)
+
+
+def create_session_store(kind: str, data_dir: str, chat_history_dir: str, cache_size: int) -> SessionStore:
+    """Build the configured backend (``journal``, ``file`` or ``sqlite``) wrapped in the hot-session LRU."""
+    if kind == "journal":
+        backend: SessionStore = JournalSessionStore(chat_history_dir)
+    elif kind == "sqlite":
+        backend = SQLiteSessionStore(os.path.join(data_dir, "sessions.sqlite"))
+    elif kind == "file":
+        backend = ShardedFileSessionStore(chat_history_dir)
+    else:
+        raise ValueError(f"Unknown session store: {kind}")
+    logger.info(f"Using {kind} session store with an LRU of {cache_size} sessions")
+    return LRUSessionStore(backend, cache_size)
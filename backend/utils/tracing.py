@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import random
+import secrets
+import cProfile
+import logging
+import contextlib
+import contextvars
+import functools
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # optional; cProfile is used instead
+    PyinstrumentProfiler = None
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ars-backend"
+TRACE_HEADER = b"x-ars-trace"
+PROFILE_HEADER = b"x-ars-profile"
+TRACE_ID_HEADER = b"x-ars-trace-id"
+
+PRUNE_EVERY_BYTES = 1024 * 1024
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    """
+    One timed operation of a trace. Use ``span()`` rather than creating these directly.
+
+    Attributes:
+        trace (Trace): The trace this span belongs to.
+        span_id (str): 16 hex digits.
+        parent_id (Optional[str]): Parent span id, None for the root.
+        name (str): Operation name, e.g. "load_chat_history" or "llm.map_answer".
+        attributes (Dict[str, Any]): Key/value annotations.
+    """
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any],
+                 kind: int = SPAN_KIND_INTERNAL):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        trace.spans.append(self)
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        record = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or time.time_ns()),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            record["parentSpanId"] = self.parent_id
+        return record
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def prune_directory(directory: str, max_bytes: int) -> None:
+    """Delete the oldest files in ``directory`` until the rest fit in ``max_bytes``."""
+    try:
+        stats = [(entry.stat(), entry.path) for entry in os.scandir(directory) if entry.is_file()]
+        files = sorted(((stat.st_mtime, stat.st_size, path) for stat, path in stats), reverse=True)
+    except OSError as e:
+        logger.error(f"Failed to list {directory}: {e}")
+        return
+    total = 0
+    for _, size, path in files:
+        total += size
+        if total > max_bytes:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Failed to remove {path}: {e}")
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("ars_current_span", default=None)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span. A no-op yielding None when the request is not traced."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current.reset(token)
+
+
+def annotate(key: str, value: Any) -> None:
+    """Set an attribute on the current span, if the request is traced."""
+    current = _current.get()
+    if current is not None:
+        current.set(key, value)
+
+
+def traced(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Wrap an async function in a span named after it."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces and/or profiles sampled requests.
+
+    A request is traced when it falls within ``trace_rate``, or when
+    ``debug_token`` is set and the request carries ``X-ARS-Trace: <debug_token>``;
+    its spans are appended as one OTLP/JSON ExportTraceServiceRequest per line
+    to ``trace_dir``, and the trace id is returned in ``X-ARS-Trace-Id``. A
+    request is profiled the same way via ``profile_rate`` and ``X-ARS-Profile``;
+    the profile goes to ``profile_dir`` as speedscope JSON (pyinstrument) or a
+    pstats file (cProfile). Without a token the headers are ignored, so clients
+    cannot switch either on. cProfile sees the whole worker thread, so concurrent
+    requests show up in its profiles; only one request per worker is profiled at
+    a time. Each directory is pruned, oldest files first, to ``max_dir_bytes``.
+    """
+    def __init__(self, app, trace_dir: str, profile_dir: str, trace_rate: float, profile_rate: float,
+                 debug_token: Optional[str] = None, max_dir_bytes: int = 256 * 1024 * 1024):
+        self.app = app
+        self.trace_dir = trace_dir
+        self.profile_dir = profile_dir
+        self.trace_rate = trace_rate
+        self.profile_rate = profile_rate
+        self.debug_token = debug_token.encode("utf-8") if debug_token else None
+        self.max_dir_bytes = max_dir_bytes
+        self._profiling = False
+        self._trace_bytes_since_prune = 0
+
+    def _requested(self, headers: Dict[bytes, bytes], name: bytes) -> bool:
+        value = headers.get(name)
+        return self.debug_token is not None and value is not None and secrets.compare_digest(value, self.debug_token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        traced_request = self._requested(headers, TRACE_HEADER) or random.random() < self.trace_rate
+        profiled = (self._requested(headers, PROFILE_HEADER) or random.random() < self.profile_rate) and not self._profiling
+        if not traced_request and not profiled:
+            return await self.app(scope, receive, send)
+
+        root = token = None
+        if traced_request:
+            root = Span(Trace(), f"{scope['method']} {scope['path']}", None,
+                        {"http.method": scope["method"], "http.route": scope["path"]}, SPAN_KIND_SERVER)
+            token = _current.set(root)
+
+        async def send_wrapper(message):
+            if root is not None:
+                if message["type"] == "http.response.start":
+                    root.set("http.status_code", message["status"])
+                    message["headers"] = list(message.get("headers") or []) + [
+                        (TRACE_ID_HEADER, root.trace.trace_id.encode("ascii"))
+                    ]
+                elif message["type"] == "http.response.body" and not message.get("more_body"):
+                    # Background tasks run after this and show up as spans past the root's end.
+                    root.end = time.time_ns()
+            await send(message)
+
+        profiler = self._start_profiler() if profiled else None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            if root is not None:
+                root.error = repr(e)
+            raise
+        finally:
+            if profiler is not None:
+                self._finish_profiler(profiler, scope, root)
+            if root is not None:
+                _current.reset(token)
+                root.end = root.end or time.time_ns()
+                self._export(root.trace)
+
+    def _export(self, trace: Trace) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    _otlp_attribute("service.name", SERVICE_NAME),
+                    _otlp_attribute("process.pid", os.getpid()),
+                ]},
+                "scopeSpans": [{"scope": {"name": "ars"}, "spans": [s.to_otlp() for s in trace.spans]}],
+            }]
+        }
+        path = os.path.join(self.trace_dir, f"traces-{time.strftime('%Y%m%d')}-{os.getpid()}.jsonl")
+        line = json.dumps(payload, ensure_ascii=False) + "\n"
+        try:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f"Failed to write trace {trace.trace_id}: {e}")
+            return
+        # Listing the directory on every trace would cost more than the trace itself.
+        self._trace_bytes_since_prune += len(line)
+        if self._trace_bytes_since_prune >= PRUNE_EVERY_BYTES:
+            self._trace_bytes_since_prune = 0
+            prune_directory(self.trace_dir, self.max_dir_bytes)
+
+    def _start_profiler(self):
+        self._profiling = True
+        if PyinstrumentProfiler is not None:
+            profiler = PyinstrumentProfiler(async_mode="enabled")
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _finish_profiler(self, profiler, scope, root: Optional[Span]) -> None:
+        self._profiling = False
+        name = root.trace.trace_id if root is not None else secrets.token_hex(8)
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['path'].strip('/').replace('/', '_') or 'root'}-{name}"
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            if PyinstrumentProfiler is not None:
+                from pyinstrument.renderers import SpeedscopeRenderer
+                profiler.stop()
+                path = os.path.join(self.profile_dir, f"{stem}.speedscope.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output(SpeedscopeRenderer()))
+            else:
+                profiler.disable()
+                path = os.path.join(self.profile_dir, f"{stem}.pstats")
+                profiler.dump_stats(path)
+            logger.info(f"Wrote profile {path}")
+        except OSError as e:
+            logger.error(f"Failed to write profile: {e}")
+        prune_directory(self.profile_dir, self.max_dir_bytes)
@@ -0,0 +1,117 @@
+import mmap
+import struct
+import logging
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+from utils.question_nodes import AnswerNode, QuestionNode
+from utils.tree_registry import QuestionTree
+
+logger = logging.getLogger(__name__)
+
+# Must match excel/compile_trees.py, which writes these files.
+MAGIC = b"ARSB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHH32s5I6I")
+QUESTION_RECORD = struct.Struct("<5I")
+ANSWER_RECORD = struct.Struct("<5I")
+
+
+class MappedQuestions(Mapping):
+    """
+    Read-only ``{questionId: QuestionNode}`` view over a memory-mapped compiled tree.
+
+    The file is mapped read-only, so every worker shares the same page-cache pages.
+    Nodes are decoded on first access and then kept.
+    """
+    def __init__(self, buffer: mmap.mmap):
+        self._buffer = buffer
+        (
+            _, _, _, _,
+            self._n_strings, self._n_questions, _, _, self._n_roots,
+            self._string_index_off, self._blob_off, self._questions_off,
+            self._answers_off, self._children_off, self._roots_off,
+        ) = HEADER.unpack_from(buffer, 0)
+        self._nodes: Dict[int, QuestionNode] = {}
+        self._index = {self._string(self._question_record(i)[0]): i for i in range(self._n_questions)}
+
+    def _string(self, index: int) -> str:
+        start, end = struct.unpack_from("<2I", self._buffer, self._string_index_off + 4 * index)
+        return self._buffer[self._blob_off + start:self._blob_off + end].decode("utf-8")
+
+    def _question_record(self, index: int):
+        return QUESTION_RECORD.unpack_from(self._buffer, self._questions_off + QUESTION_RECORD.size * index)
+
+    def _node(self, index: int) -> QuestionNode:
+        node = self._nodes.get(index)
+        if node is None:
+            id_str, type_str, text_str, first_answer, n_answers = self._question_record(index)
+            answers = []
+            for a in range(first_answer, first_answer + n_answers):
+                answer_id, text, print_text, first_child, n_children = ANSWER_RECORD.unpack_from(
+                    self._buffer, self._answers_off + ANSWER_RECORD.size * a
+                )
+                child_indexes = struct.unpack_from(f"<{n_children}I", self._buffer, self._children_off + 4 * first_child)
+                answers.append(AnswerNode(
+                    self._string(answer_id), self._string(text), self._string(print_text),
+                    tuple(self._string(self._question_record(c)[0]) for c in child_indexes),
+                ))
+            node = QuestionNode(self._string(id_str), self._string(type_str), self._string(text_str), tuple(answers))
+            self._nodes[index] = node
+        return node
+
+    def texts(self) -> List[str]:
+        """Every question text and answer text, one per occurrence, read from the records without decoding any node."""
+        decoded: Dict[int, str] = {}
+        texts = []
+        for i in range(self._n_questions):
+            _, _, text_str, first_answer, n_answers = self._question_record(i)
+            indexes = [text_str] + [
+                ANSWER_RECORD.unpack_from(self._buffer, self._answers_off + ANSWER_RECORD.size * a)[1]
+                for a in range(first_answer, first_answer + n_answers)
+            ]
+            for index in indexes:
+                if index not in decoded:
+                    decoded[index] = self._string(index)
+                texts.append(decoded[index])
+        return texts
+
+    def root_ids(self):
+        indexes = struct.unpack_from(f"<{self._n_roots}I", self._buffer, self._roots_off)
+        return [self._string(self._question_record(i)[0]) for i in indexes]
+
+    def __getitem__(self, question_id: str) -> QuestionNode:
+        return self._node(self._index[question_id])
+
+    def __contains__(self, question_id: object) -> bool:
+        return question_id in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return self._n_questions
+
+
+def open_compiled_tree(path: str, name: str, source_sha256: bytes) -> Optional[QuestionTree]:
+    """Map the compiled tree at ``path`` if it was built from JSON with digest ``source_sha256``.
+
+    Returns None when the file is missing, malformed or stale, so the caller
+    can fall back to parsing the JSON.
+    """
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(buffer) < HEADER.size:
+        return None
+    magic, version, _, digest = HEADER.unpack_from(buffer, 0)[:4]
+    if magic != MAGIC or version != FORMAT_VERSION:
+        logger.warning(f"Ignoring compiled tree {path}: unknown format")
+        return None
+    if digest != source_sha256:
+        logger.info(f"Ignoring stale compiled tree {path}")
+        return None
+    questions = MappedQuestions(buffer)
+    return QuestionTree(name, questions.root_ids(), questions)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionTree:
+    """
+    One loaded question tree.
+
+    Attributes:
+        name (str): Tree name (the JSON file stem).
+        version (str): Content hash of the JSON file the tree was built from.
+        root_ids (List[str]): Top-level question ids in asking order.
+        questions (Dict[str, Any]): Every question in the tree, nested ones included, by id.
+        plans (Dict[str, Any]): Per-question data the caller derives from ``questions``, cached by question id.
+    """
+    def __init__(self, name: str, root_ids: List[str], questions: Dict[str, Any], version: Optional[str] = None):
+        self.name = name
+        self.version = version
+        self.root_ids = root_ids
+        self.questions = questions
+        self.plans: Dict[str, Any] = {}
+
+    def get(self, question_id: str) -> Any:
+        return self.questions[question_id]
+
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self.questions
+
+    def __repr__(self):
+        return f"QuestionTree({self.name!r}, version={self.version}, {len(self.questions)} questions)"
+
+
+def content_version(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class TreeRegistry:
+    """
+    All question trees of a directory, indexed by (tree, version, questionId).
+
+    ``build_tree`` turns a tree name and the decoded JSON list into a QuestionTree,
+    so the registry does not depend on how question objects are represented.
+    If ``load_compiled`` is given, it is first asked for a prebuilt tree matching
+    the JSON file's sha256 digest; it returns None to fall back to parsing.
+    ``on_reload`` is called after ``refresh()`` swapped in changed trees, in the
+    thread ``watch`` runs refreshes on, so derived indexes can be rebuilt
+    there rather than on the request path.
+
+    Trees are versioned by content hash. ``refresh()`` picks up changed files and
+    swaps the new version in as current; sessions pass the version they started
+    on and keep getting that version. Every loaded version is also copied to
+    ``archive_dir``, so a worker that never saw an old version (or restarted
+    since) can still serve sessions pinned to it. Non-current versions that no
+    session has touched for a while are dropped from memory by ``evict()``; a
+    version counts as used when it is served and when it is superseded.
+
+    Methods:
+        load(): Parse every ``*.json`` tree in the directory.
+        refresh(): Load trees whose file content changed; returns the reloaded names.
+        evict(idle_seconds): Drop superseded versions not used for ``idle_seconds``.
+        preload(name, version): Load an archived version in a thread, so ``tree()`` finds it in memory.
+        watch(interval, idle_seconds): Run refresh/evict periodically in the background.
+        names(): Names of the current trees.
+        tree(name, version): A tree, the current version unless one is pinned.
+        question(tree_name, question_id, version): One question, without any file I/O.
+    """
+    def __init__(
+        self,
+        trees_dir: str,
+        build_tree: Callable[[str, List[Dict[str, Any]]], QuestionTree],
+        archive_dir: Optional[str] = None,
+        load_compiled: Optional[Callable[[str, bytes], Optional[QuestionTree]]] = None,
+        on_reload: Optional[Callable[[], None]] = None,
+    ):
+        self.trees_dir = trees_dir
+        self.build_tree = build_tree
+        self.load_compiled = load_compiled
+        self.on_reload = on_reload
+        self.archive_dir = archive_dir
+        self._current: Dict[str, QuestionTree] = {}
+        self._versions: Dict[Tuple[str, str], QuestionTree] = {}
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
+
+    def _build(self, name: str, raw: bytes, version: str) -> QuestionTree:
+        tree = self.load_compiled(name, hashlib.sha256(raw).digest()) if self.load_compiled else None
+        if tree is None:
+            try:
+                file_contents = json.loads(raw.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                logger.error(f"Invalid JSON in question tree {name}: {e}")
+                raise
+            tree = self.build_tree(name, file_contents)
+        tree.version = version
+        self._versions[(name, version)] = tree
+        self._last_used[(name, version)] = time.time()
+        return tree
+
+    def _archive(self, name: str, version: str, raw: bytes) -> None:
+        if not self.archive_dir:
+            return
+        path = os.path.join(self.archive_dir, f"{name}.{version}.json")
+        if os.path.exists(path):
+            return
+        os.makedirs(self.archive_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.archive_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+
+    def _scan(self, force: bool) -> List[str]:
+        folder = Path(self.trees_dir)
+        if not folder.exists():
+            logger.error(f"Question tree directory not found at {self.trees_dir}")
+            return []
+        current = dict(self._current)
+        file_stats = {}
+        reloaded = []
+        now = time.time()
+        for file_path in sorted(folder.glob("*.json")):
+            name = file_path.stem
+            st = file_path.stat()
+            file_stats[name] = (st.st_mtime_ns, st.st_size)
+            if not force and self._file_stats.get(name) == file_stats[name]:
+                continue
+            raw = file_path.read_bytes()
+            version = content_version(raw)
+            if name in current and current[name].version == version:
+                continue
+            tree = self._versions.get((name, version)) or self._build(name, raw, version)
+            self._archive(name, version, raw)
+            if name in current:
+                # Sessions are still pinned to the old version, so its idle time starts now.
+                self._last_used[(name, current[name].version)] = now
+            current[name] = tree
+            reloaded.append(name)
+        for name in set(current) - set(file_stats):
+            self._last_used[(name, current[name].version)] = now
+            del current[name]
+            reloaded.append(name)
+        # Swap in one assignment so readers see either the old or the new set of trees.
+        self._current = current
+        self._file_stats = file_stats
+        return reloaded
+
+    def load(self) -> None:
+        self._scan(force=True)
+        logger.info(f"Loaded question trees: {list(self._current.values())}")
+
+    def refresh(self) -> List[str]:
+        reloaded = self._scan(force=False)
+        for name in reloaded:
+            tree = self._current.get(name)
+            logger.info(f"Question tree {name} is now at version {tree.version if tree else 'removed'}")
+        if reloaded and self.on_reload:
+            self.on_reload()
+        return reloaded
+
+    def evict(self, idle_seconds: float) -> None:
+        current_keys = {(tree.name, tree.version) for tree in self._current.values()}
+        now = time.time()
+        for key in list(self._versions):
+            if key not in current_keys and now - self._last_used.get(key, 0.0) > idle_seconds:
+                del self._versions[key]
+                self._last_used.pop(key, None)
+                logger.info(f"Evicted question tree {key[0]} version {key[1]}")
+
+    async def watch(self, interval: float, idle_seconds: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+                self.evict(idle_seconds)
+            except Exception as e:
+                logger.error(f"Question tree reload failed: {e}")
+
+    async def preload(self, name: str, version: Optional[str]) -> None:
+        if version is not None and (name, version) not in self._versions:
+            await asyncio.to_thread(self.tree, name, version)
+
+    def names(self) -> List[str]:
+        return list(self._current)
+
+    def tree(self, name: str, version: Optional[str] = None) -> Optional[QuestionTree]:
+        current = self._current.get(name)
+        if version is None or (current is not None and current.version == version):
+            if current is not None:
+                self._last_used[(name, current.version)] = time.time()
+            return current
+        key = (name, version)
+        tree = self._versions.get(key)
+        if tree is None and self.archive_dir:
+            path = os.path.join(self.archive_dir, f"{name}.{version}.json")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    tree = self._build(name, f.read(), version)
+        if tree is None:
+            logger.warning(f"Question tree {name} version {version} is unavailable, using the current version")
+            return current
+        self._last_used[key] = time.time()
+        return tree
+
+    def question(self, tree_name: str, question_id: str, version: Optional[str] = None) -> Any:
+        return self.tree(tree_name, version).get(question_id)
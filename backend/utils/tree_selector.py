@@ -0,0 +1,106 @@
+import os
+import math
+import logging
+import importlib.util
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.answer_matcher import normalize_answer
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZES = (3, 4, 5)
+# Keyword groups from excel/trees.py count this many times more than question text.
+KEYWORD_WEIGHT = 8.0
+
+
+def char_ngrams(text: str) -> Counter:
+    """Character n-grams of every word, padded with spaces so word starts and ends count.
+
+    Finnish inflects heavily ("vatsa", "vatsaan", "vatsakipu"); shared n-grams
+    stand in for a stemmer.
+    """
+    grams = Counter()
+    for word in normalize_answer(text).replace("_", " ").split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                grams[padded[i:i + n]] += 1
+    return grams
+
+
+def load_keyword_groups(path: str) -> Dict[str, List[str]]:
+    """Read BIG_TREES / SMALL_TREES from excel/trees.py as ``{tree name: [keyword, ...]}``."""
+    try:
+        spec = importlib.util.spec_from_file_location("ars_tree_keywords", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except (OSError, SyntaxError) as e:
+        logger.warning(f"Tree keywords not loaded from {path}: {e}")
+        return {}
+    groups: Dict[str, List[str]] = {}
+    for table in (getattr(module, "BIG_TREES", {}), getattr(module, "SMALL_TREES", {})):
+        for keywords, tree_path in table.items():
+            if isinstance(keywords, str):
+                keywords = (keywords,)
+            name = os.path.splitext(os.path.basename(tree_path))[0]
+            groups.setdefault(name, []).extend(keywords)
+    return groups
+
+
+class TreeSelector:
+    """
+    TF-IDF index over character n-grams that ranks question trees for a free-text complaint.
+
+    Each tree is one document: its name and keyword groups (weighted by
+    KEYWORD_WEIGHT) plus the text of all its questions and answers.
+
+    Methods:
+        rank(text): Return [(tree name, cosine score)] best first, trees with no overlap left out.
+        select(text, min_score, margin): Return (best tree or None, ranking); None when too close to call.
+    """
+    def __init__(self, documents: Dict[str, Tuple[Iterable[str], Iterable[str]]]):
+        counts = {}
+        for name, (keywords, texts) in documents.items():
+            grams = Counter()
+            for keyword in [name, *keywords]:
+                for gram, count in char_ngrams(keyword).items():
+                    grams[gram] += KEYWORD_WEIGHT * count
+            for text in texts:
+                grams.update(char_ngrams(text))
+            counts[name] = grams
+
+        document_frequency = Counter(gram for grams in counts.values() for gram in grams)
+        n_documents = len(counts)
+        self._idf = {
+            gram: math.log((1 + n_documents) / (1 + df)) + 1.0 for gram, df in document_frequency.items()
+        }
+        # Inverted index: gram -> [(tree, normalized weight)]
+        self._postings: Dict[str, List[Tuple[str, float]]] = {}
+        for name, grams in counts.items():
+            weights = {gram: (1.0 + math.log(count)) * self._idf[gram] for gram, count in grams.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                self._postings.setdefault(gram, []).append((name, weight / norm))
+
+    def rank(self, text: str) -> List[Tuple[str, float]]:
+        query = {
+            gram: (1.0 + math.log(count)) * self._idf[gram]
+            for gram, count in char_ngrams(text).items() if gram in self._idf
+        }
+        norm = math.sqrt(sum(w * w for w in query.values()))
+        if not norm:
+            return []
+        scores: Dict[str, float] = {}
+        for gram, weight in query.items():
+            for name, doc_weight in self._postings[gram]:
+                scores[name] = scores.get(name, 0.0) + weight * doc_weight
+        return sorted(((name, score / norm) for name, score in scores.items()), key=lambda item: -item[1])
+
+    def select(self, text: str, min_score: float, margin: float) -> Tuple[Optional[str], List[Tuple[str, float]]]:
+        ranking = self.rank(text)
+        if not ranking or ranking[0][1] < min_score:
+            return None, ranking
+        if len(ranking) > 1 and ranking[0][1] < ranking[1][1] * margin:
+            return None, ranking
+        return ranking[0][0], ranking
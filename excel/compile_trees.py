@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compile question tree JSON files into the read-only binary form the backend memory-maps.
+
+Layout (little-endian, see backend/utils/tree_binary.py for the reader):
+
+    header    magic "ARSB", u16 format version, u16 reserved,
+              32-byte sha256 of the source JSON file,
+              u32 counts:  strings, questions, answers, children, roots
+              u32 offsets: string index, string blob, questions, answers, children, roots
+    strings   (count + 1) u32 offsets into the blob, then the utf-8 blob
+    questions per question: u32 id, type, text (string indexes), first answer, answer count
+    answers   per answer:   u32 id, text, print text (string indexes), first child, child count
+    children  u32 question indexes
+    roots     u32 question indexes, in asking order
+
+Usage: python3 compile_trees.py  (compiles ./json/*.json into ./compiled/*.arsb)
+"""
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import tempfile
+
+
+# Globals
+input_directory = "./json"
+output_directory = "./compiled"
+# -------------------------
+
+MAGIC = b"ARSB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHH32s5I6I")
+QUESTION_RECORD = struct.Struct("<5I")
+ANSWER_RECORD = struct.Struct("<5I")
+
+
+def fiText(text):
+    # Non-choice answers store answerText as "" instead of {"FI": ...}.
+    return text.get("FI", "") if isinstance(text, dict) else (text or "")
+
+
+def compileTree(fileContents, sourceBytes):
+    strings = []
+    stringIndex = {}
+
+    def intern(value):
+        if value not in stringIndex:
+            stringIndex[value] = len(strings)
+            strings.append(value)
+        return stringIndex[value]
+
+    # Number questions in pre-order; first definition of an id wins, as in the backend.
+    questions = []
+    questionIndex = {}
+    stack = list(reversed(fileContents))
+    while stack:
+        raw = stack.pop()
+        if raw["questionId"] in questionIndex:
+            continue
+        questionIndex[raw["questionId"]] = len(questions)
+        questions.append(raw)
+        for answer in reversed(raw.get("answers") or []):
+            stack.extend(reversed(answer.get("question") or []))
+
+    questionRecords = []
+    answerRecords = []
+    children = []
+    for raw in questions:
+        answers = raw.get("answers") or []
+        questionRecords.append(QUESTION_RECORD.pack(
+            intern(raw["questionId"]), intern(raw["type"]), intern(fiText(raw.get("questionText"))),
+            len(answerRecords), len(answers)
+        ))
+        for answer in answers:
+            childIds = [child["questionId"] for child in answer.get("question") or []]
+            answerRecords.append(ANSWER_RECORD.pack(
+                intern(answer["answerId"]), intern(fiText(answer.get("answerText"))),
+                intern(fiText(answer.get("printText"))), len(children), len(childIds)
+            ))
+            children.extend(questionIndex[childId] for childId in childIds)
+    roots = [questionIndex[q["questionId"]] for q in fileContents]
+
+    blobParts = []
+    offsets = [0]
+    for value in strings:
+        encoded = value.encode("utf-8")
+        blobParts.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+    stringIndexBytes = struct.pack(f"<{len(offsets)}I", *offsets)
+    blob = b"".join(blobParts)
+
+    sections = [
+        stringIndexBytes,
+        blob,
+        b"".join(questionRecords),
+        b"".join(answerRecords),
+        struct.pack(f"<{len(children)}I", *children),
+        struct.pack(f"<{len(roots)}I", *roots),
+    ]
+    sectionOffsets = []
+    position = HEADER.size
+    for section in sections:
+        # Keep every u32 section 4-byte aligned.
+        position += (-position) % 4
+        sectionOffsets.append(position)
+        position += len(section)
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, hashlib.sha256(sourceBytes).digest(),
+        len(strings), len(questions), len(answerRecords), len(children), len(roots),
+        *sectionOffsets
+    )
+    output = bytearray(header)
+    for offset, section in zip(sectionOffsets, sections):
+        output.extend(b"\0" * (offset - len(output)))
+        output.extend(section)
+    return bytes(output)
+
+
+def compileTreeFile(jsonPath, outputPath):
+    with open(jsonPath, "rb") as f:
+        sourceBytes = f.read()
+    compiled = compileTree(json.loads(sourceBytes.decode("utf-8")), sourceBytes)
+    outputDir = os.path.dirname(outputPath) or "."
+    os.makedirs(outputDir, exist_ok=True)
+    # Replace by rename: running backends keep their mapping of the previous file intact.
+    fd, tmpPath = tempfile.mkstemp(dir=outputDir, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(compiled)
+    os.replace(tmpPath, outputPath)
+    return len(compiled)
+
+
+def main():
+    names = sys.argv[1:] or sorted(f for f in os.listdir(input_directory) if f.endswith(".json"))
+    for fileName in names:
+        jsonPath = os.path.join(input_directory, os.path.basename(fileName))
+        outputPath = os.path.join(output_directory, os.path.basename(fileName).replace(".json", ".arsb"))
+        size = compileTreeFile(jsonPath, outputPath)
+        print(f"{jsonPath} -> {outputPath} ({size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
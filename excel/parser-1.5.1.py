@@ -6,36 +6,37 @@ import csv
 import json
 import sys
 import os
+import time
+
+from compile_trees import compileTreeFile
 
 
 # Globals
 input_directory = "./csvt"
 output_directory = "./json"
+compiled_directory = "./compiled"
 # -------------------------
 
 
-def findChoices(question, fileName):
-    with open(fileName, "r", encoding="utf-8", errors="replace") as oireetFile:
-        reader = csv.reader(oireetFile)
-        result = []
-        for rowIndex, row in enumerate(reader):
-            if rowIndex < question.rowIndex:
-                continue
-            prevCol = ''
-            for colIndex, col in enumerate(row):
-                if colIndex != (question.colIndex + 2):
-                    prevCol = col
-                    continue
-                if prevCol != '' and rowIndex != question.rowIndex:
-                    return result
-                elif col != '':
-                    newAnswer = Answer()
-                    newAnswer.answerText['FI'] = col
-                    newAnswer.printText['FI'] = row[colIndex + 1]
-                    newAnswer.colIndex = colIndex
-                    newAnswer.rowIndex = rowIndex
-                    result.append(newAnswer)
-                prevCol = col
+def findChoices(question, grid):
+    # Choices sit two columns right of the question, on its row and the rows below,
+    # until a row has something in the column to their left (the next question).
+    choiceCol = question.colIndex + 2
+    result = []
+    for rowIndex in range(question.rowIndex, len(grid)):
+        row = grid[rowIndex]
+        if len(row) <= choiceCol:
+            continue
+        col = row[choiceCol]
+        if row[choiceCol - 1] != '' and rowIndex != question.rowIndex:
+            return result
+        elif col != '':
+            newAnswer = Answer()
+            newAnswer.answerText['FI'] = col
+            newAnswer.printText['FI'] = row[choiceCol + 1]
+            newAnswer.colIndex = choiceCol
+            newAnswer.rowIndex = rowIndex
+            result.append(newAnswer)
     return result
 
 
@@ -173,15 +174,17 @@ def main():
             file_path = os.path.join(input_directory, file_name)
             output_file = os.path.join(output_directory, file_name.replace(".csv", ".json"))
 
+            started = time.perf_counter()
+            # Read the sheet once; findChoices scans this grid instead of reopening the file.
             with open(file_path, "r", encoding="utf-8", errors="replace") as oireetFile:
-                reader = csv.reader(oireetFile)
+                grid = list(csv.reader(oireetFile))
                 result = []
                 currentQuestion = None
                 questionId = 1
                 category = None
                 hasErrors = False
 
-                for rowIndex, row in enumerate(reader):
+                for rowIndex, row in enumerate(grid):
                     if rowIndex < 1:
                         continue
                     for colIndex, col in enumerate(row):
@@ -206,7 +209,7 @@ def main():
                                     print(f"ERROR at: {rowIndex + 1},{colIndex + 1}, Invalid type '{col}'")
                             elif ((colIndex - 1) % 4) == 2 and currentQuestion is not None and currentQuestion.type is not None:
                                 if currentQuestion.type.strip() in ['valinta', 'monivalinta']:
-                                    answers = findChoices(currentQuestion, file_path)
+                                    answers = findChoices(currentQuestion, grid)
                                     if len(answers) == 1:
                                         print(f"ERROR at: {rowIndex + 1},{colIndex + 1}, Only one choice given")
                                         hasErrors = True
@@ -228,8 +231,10 @@ def main():
                             elif ((colIndex - 1) % 4) == 3 and currentQuestion is not None and currentQuestion.type is not None:
                                 continue
 
+            print(f"{file_name}: {len(grid)} rows parsed in {(time.perf_counter() - started) * 1000:.1f} ms")
             if not hasErrors:
                 printResultAsJson(result, output_file)
+                compileTreeFile(output_file, os.path.join(compiled_directory, file_name.replace(".csv", ".arsb")))
 
 
 if __name__ == "__main__":
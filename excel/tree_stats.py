@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Path statistics for question trees, for capacity planning and spotting trees that need lookahead inference.
+
+The backend asks a tree's root questions in order and, after each answer,
+the follow-up questions of the chosen answer before anything else. A path is
+one complete conversation. For every tree in ./json this reports:
+
+    paths         distinct question sequences a patient can go through
+    combinations  distinct answer combinations (a ligert question counts its 10 scale values)
+    questions     questions asked per path: min, mean, p50, p95, max
+    depth         follow-up nesting depth of a path: mean and max
+    branching     answers per choice question, distinct follow-up outcomes per question,
+                  share of answers that open follow-up questions
+    llm calls     worst case for the longest path, and for a path of mean length
+
+Means and percentiles assume every answer of a question is equally likely.
+Each question and each distinct follow-up list is evaluated once, bottom up
+with an explicit stack, so large trees take well under a second.
+
+Usage: python3 tree_stats.py [tree.json ...] [--json stats.json]
+"""
+
+import os
+import json
+import time
+import argparse
+
+
+# Globals
+input_directory = "./json"
+# -------------------------
+
+# Matches backend LIGERT_SCALE: answers 1-10; ligert questions have no follow-ups.
+LIGERT_VALUES = 10
+# Worst case per asked question: map_answer (no local match), infer_answer (speculation for the
+# next question), lookahead_answers (long free-text answer) and update_summary (running draft).
+# Re-asks of unclear answers come on top. Per conversation: select_tree and the final summary.
+LLM_CALLS_PER_QUESTION = 4
+LLM_CALLS_PER_CONVERSATION = 2
+
+
+class PathStats:
+    """
+    Statistics of a question list asked in order, each with its own follow-ups.
+
+    Attributes:
+        paths (int): Distinct question sequences.
+        combinations (int): Distinct answer combinations.
+        lengths (list): lengths[n] = probability that n questions are asked.
+        depthCdf (list): depthCdf[d] = probability that the nesting depth is at most d (1.0 past the end).
+        minLength, maxLength, maxDepth (int)
+    """
+    __slots__ = ("paths", "combinations", "lengths", "depthCdf", "minLength", "maxLength", "maxDepth")
+
+    def __init__(self, paths, combinations, lengths, depthCdf, minLength, maxLength, maxDepth):
+        self.paths = paths
+        self.combinations = combinations
+        self.lengths = lengths
+        self.depthCdf = depthCdf
+        self.minLength = minLength
+        self.maxLength = maxLength
+        self.maxDepth = maxDepth
+
+
+EMPTY = PathStats(1, 1, [1.0], [1.0], 0, 0, 0)
+
+
+def convolve(a, b):
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i + j] += x * y
+    return result
+
+
+def cdfAt(cdf, d):
+    return cdf[d] if d < len(cdf) else 1.0
+
+
+def followedBy(a, b):
+    """Stats of list ``a`` then list ``b``; the two parts are answered independently."""
+    size = max(len(a.depthCdf), len(b.depthCdf))
+    return PathStats(
+        a.paths * b.paths,
+        a.combinations * b.combinations,
+        convolve(a.lengths, b.lengths),
+        # Depth of the whole is the larger of the two depths.
+        [cdfAt(a.depthCdf, d) * cdfAt(b.depthCdf, d) for d in range(size)],
+        a.minLength + b.minLength,
+        a.maxLength + b.maxLength,
+        max(a.maxDepth, b.maxDepth),
+    )
+
+
+def oneOf(outcomes):
+    """Stats of one question whose answer leads to one of ``outcomes`` (one PathStats per answer)."""
+    weight = 1.0 / len(outcomes)
+    lengths = [0.0] * (1 + max(len(o.lengths) for o in outcomes))
+    size = 1 + max(len(o.depthCdf) for o in outcomes)
+    depthCdf = [0.0] * size
+    for outcome in outcomes:
+        for n, p in enumerate(outcome.lengths):
+            lengths[n + 1] += weight * p
+        for d in range(1, size):
+            depthCdf[d] += weight * cdfAt(outcome.depthCdf, d - 1)
+    return lengths, depthCdf
+
+
+def nodeTable(fileContents):
+    """{questionId: raw question}; the first definition of an id wins, as in the backend."""
+    nodes = {}
+    stack = list(reversed(fileContents))
+    while stack:
+        raw = stack.pop()
+        if raw["questionId"] in nodes:
+            continue
+        nodes[raw["questionId"]] = raw
+        for answer in reversed(raw.get("answers") or []):
+            stack.extend(reversed(answer.get("question") or []))
+    return nodes
+
+
+def followUps(raw):
+    """Follow-up id lists per answer, in answer order."""
+    if raw["type"] == "ligert" or not raw.get("answers"):
+        return [()]
+    return [tuple(child["questionId"] for child in answer.get("question") or []) for answer in raw["answers"]]
+
+
+def treeStats(fileContents):
+    nodes = nodeTable(fileContents)
+    questionMemo = {}
+    listMemo = {(): EMPTY}
+
+    def listStats(ids):
+        if ids not in listMemo:
+            stats = EMPTY
+            for questionId in ids:
+                stats = followedBy(stats, questionMemo[questionId])
+            listMemo[ids] = stats
+        return listMemo[ids]
+
+    # Post-order without recursion: a question is evaluated once all its follow-ups are.
+    onPath = set()
+    for rootId in (q["questionId"] for q in fileContents):
+        stack = [(rootId, False)]
+        while stack:
+            questionId, expanded = stack.pop()
+            if questionId in questionMemo:
+                continue
+            raw = nodes[questionId]
+            if not expanded:
+                onPath.add(questionId)
+                stack.append((questionId, True))
+                for ids in followUps(raw):
+                    for childId in ids:
+                        if childId in onPath:
+                            raise ValueError(f"Question {childId} is its own follow-up")
+                        if childId not in questionMemo:
+                            stack.append((childId, False))
+                continue
+            onPath.discard(questionId)
+            outcomes = [listStats(ids) for ids in followUps(raw)]
+            distinct = {ids: listMemo[ids] for ids in followUps(raw)}
+            lengths, depthCdf = oneOf(outcomes)
+            scale = LIGERT_VALUES if raw["type"] == "ligert" else 1
+            questionMemo[questionId] = PathStats(
+                sum(stats.paths for stats in distinct.values()),
+                scale * sum(stats.combinations for stats in outcomes),
+                lengths,
+                depthCdf,
+                1 + min(stats.minLength for stats in outcomes),
+                1 + max(stats.maxLength for stats in outcomes),
+                1 + max(stats.maxDepth for stats in outcomes),
+            )
+
+    total = listStats(tuple(q["questionId"] for q in fileContents))
+    choiceQuestions = [raw for raw in nodes.values() if raw["type"] != "ligert" and raw.get("answers")]
+    answers = [answer for raw in choiceQuestions for answer in raw["answers"]]
+    meanLength = sum(n * p for n, p in enumerate(total.lengths))
+    return {
+        "questions": len(nodes),
+        "paths": total.paths,
+        "combinations": total.combinations,
+        "questions_min": total.minLength,
+        "questions_mean": round(meanLength, 2),
+        "questions_p50": percentile(total.lengths, 0.50),
+        "questions_p95": percentile(total.lengths, 0.95),
+        "questions_max": total.maxLength,
+        "depth_mean": round(sum(1.0 - p for p in total.depthCdf), 2),
+        "depth_max": total.maxDepth,
+        "answers_per_question": round(len(answers) / len(choiceQuestions), 2) if choiceQuestions else 0.0,
+        "outcomes_per_question": round(
+            sum(len(set(followUps(raw))) for raw in nodes.values()) / len(nodes), 2
+        ) if nodes else 0.0,
+        "answers_with_follow_ups": round(
+            sum(1 for answer in answers if answer.get("question")) / len(answers), 3
+        ) if answers else 0.0,
+        "llm_calls_worst": total.maxLength * LLM_CALLS_PER_QUESTION + LLM_CALLS_PER_CONVERSATION,
+        "llm_calls_mean_path": round(meanLength * LLM_CALLS_PER_QUESTION + LLM_CALLS_PER_CONVERSATION, 1),
+    }
+
+
+def percentile(lengths, q):
+    cumulative = 0.0
+    for n, p in enumerate(lengths):
+        cumulative += p
+        if cumulative >= q - 1e-12:
+            return n
+    return len(lengths) - 1
+
+
+def formatCount(value):
+    return str(value) if value < 10 ** 9 else f"{value:.3e}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Path statistics for question trees")
+    parser.add_argument("trees", nargs="*", help="tree JSON files (default: every file in ./json)")
+    parser.add_argument("--json", dest="jsonPath", help="also write the statistics to this file")
+    args = parser.parse_args()
+
+    paths = args.trees or [
+        os.path.join(input_directory, f) for f in sorted(os.listdir(input_directory)) if f.endswith(".json")
+    ]
+    results = {}
+    print(f"{'tree':<24}{'questions':>10}{'paths':>12}{'combinations':>14}{'q min/mean/p95/max':>22}"
+          f"{'depth mean/max':>16}{'branching':>12}{'llm worst':>11}{'ms':>8}")
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            fileContents = json.load(f)
+        started = time.perf_counter()
+        stats = treeStats(fileContents)
+        elapsed = (time.perf_counter() - started) * 1000
+        name = os.path.splitext(os.path.basename(path))[0]
+        results[name] = stats
+        questions = f"{stats['questions_min']}/{stats['questions_mean']:.1f}/{stats['questions_p95']}/{stats['questions_max']}"
+        depth = f"{stats['depth_mean']:.1f}/{stats['depth_max']}"
+        branching = f"{stats['answers_per_question']:.1f}/{stats['outcomes_per_question']:.1f}"
+        print(f"{name:<24}{stats['questions']:>10}{formatCount(stats['paths']):>12}"
+              f"{formatCount(stats['combinations']):>14}{questions:>22}{depth:>16}{branching:>12}"
+              f"{stats['llm_calls_worst']:>11}{elapsed:>8.1f}")
+
+    if args.jsonPath:
+        with open(args.jsonPath, "w", encoding="utf-8") as f:
+            # Path counts can exceed what JSON readers hold in a double; keep them exact as strings.
+            json.dump({name: {key: str(value) if key in ("paths", "combinations") else value
+                              for key, value in stats.items()} for name, stats in results.items()},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Wrote {args.jsonPath}")
+
+
+if __name__ == "__main__":
+    main()
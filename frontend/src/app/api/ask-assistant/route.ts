@@ -4,7 +4,7 @@ import { Message } from "@/types/message";
 
 export async function POST(req: NextRequest) {
   try {
-    const { session_id, user_answer } = await req.json();
+    const { session_id, user_answer, request_id } = await req.json();
 
     if (!session_id || !user_answer) {
       return NextResponse.json(
@@ -13,11 +13,15 @@ export async function POST(req: NextRequest) {
       );
     }
 
-    // Call backend API
+    // Call backend API; the key lets the backend replay a duplicate submission
+    const headers: Record<string, string> = { "Content-Type": "application/json" };
+    if (request_id) {
+      headers["Idempotency-Key"] = request_id;
+    }
     const apiResponse = await fetch("http://localhost:8000/handle-answer", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_id, user_answer }),
+      headers,
+      body: JSON.stringify({ session_id, user_answer, request_id }),
     });
 
     if (!apiResponse.ok) {
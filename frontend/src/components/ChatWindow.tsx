@@ -2,6 +2,7 @@
 import { useEffect, useRef, useState } from "react";
 import EastIcon from '@mui/icons-material/East';
 import { Message } from "@/types/message";
+import { requestKey } from "@/lib/requestKey";
 
 type Props = {
   session_id: string;
@@ -40,6 +41,7 @@ export default function ChatWindow({ session_id }: Props) {
   const handleSend = async () => {
     if (user_answer.trim() === "") return;
 
+    const request_id = requestKey(session_id, messages.length);
     const userMessage: Message = { role: "user", content: user_answer };
     const updatedMessages: Message[] = [...messages, userMessage];
     setMessages(updatedMessages);
@@ -49,7 +51,7 @@ export default function ChatWindow({ session_id }: Props) {
       const res = await fetch(`/api/ask-assistant`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ user_answer, session_id }),
+        body: JSON.stringify({ user_answer, session_id, request_id }),
       });
 
       const assistantReply: Message = await res.json();
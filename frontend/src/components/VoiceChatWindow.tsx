@@ -4,6 +4,7 @@ import { useEffect, useState, useRef } from 'react';
 import UploadFileIcon from '@mui/icons-material/UploadFile';
 import MicIcon from '@mui/icons-material/Mic';
 import SendIcon from '@mui/icons-material/Send';
+import { requestKey } from '@/lib/requestKey';
 
 type Props = {
   session_id: string;
@@ -149,6 +150,7 @@ export default function VoiceChatWindow({ session_id }: Props) {
       return;
     }
 
+    const request_id = requestKey(session_id, chatData.messages.length);
     try {
       const formData = new FormData();
       formData.append('audio', audioFileToSend, audioFileToSend.name);
@@ -215,7 +217,7 @@ export default function VoiceChatWindow({ session_id }: Props) {
           const assistantApiRes = await fetch(`/api/ask-assistant`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ user_answer, session_id }), // Send user's message content
+            body: JSON.stringify({ user_answer, session_id, request_id }), // Send user's message content
           });
 
           if (!assistantApiRes.ok) {
@@ -0,0 +1,26 @@
+// src/lib/requestKey.ts
+
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost), and the
+// deploy serves plain HTTP, so fall back to getRandomValues or Math.random.
+function randomId(): string {
+  if (typeof crypto !== "undefined") {
+    if (typeof crypto.randomUUID === "function") {
+      return crypto.randomUUID();
+    }
+    if (typeof crypto.getRandomValues === "function") {
+      const bytes = crypto.getRandomValues(new Uint8Array(16));
+      return Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("");
+    }
+  }
+  return `${Date.now().toString(16)}${Math.random().toString(16).slice(2)}`;
+}
+
+let pageId: string | null = null;
+
+// Idempotency key for answering the question pending after `turn` messages.
+// Sends made before the conversation moves on, such as a double click, get the
+// same key, so the backend answers the pending question only once.
+export function requestKey(session_id: string, turn: number): string {
+  pageId ??= randomId();
+  return `${session_id}:${turn}:${pageId}`;
+}